@@ -0,0 +1,527 @@
+# flat_processor.py
+#
+# Produces the minimally processed flat outputs for the R0 sections
+# that are delivered without the full nested restructure: pivot the
+# long-form responses, clean each value against the flat section schema
+# and rebuild the two small nested shapes (PhysicalDevelopment and
+# Pregnancies) that the flat delivery still carries.
+
+import os
+import sys
+import json
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = None
+    pd = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_CFG_PATH = os.path.abspath(
+    "N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"
+)
+if _CFG_PATH not in sys.path:
+    sys.path.insert(0, _CFG_PATH)
+
+import config as cf
+import cleaning_rules as cr
+from common_utils import load_schema
+from utilities import connect_DB, read_data
+import nested_utils as nv
+from processing_utils import (_BRA_FIELDS, _build_field_table,
+                              _is_array_int_field, make_converter)
+
+# rename_variable depends only on the variable name, so resolve each
+# distinct name once rather than once per participant
+_rename_cached = lru_cache(maxsize=None)(nv.rename_variable)
+
+# schemas are cached per (path, mtime) by load_schema, so the same
+# parsed object comes back across sections — key the derived variable
+# mapping on its identity
+_VAR_MAPPINGS = {}
+
+
+def _variable_mapping_for(schema):
+    mapping = _VAR_MAPPINGS.get(id(schema))
+    if mapping is None:
+        mapping = {
+            prop['name']: key
+            for key, prop in schema['additionalProperties']['properties'].items()
+            if 'name' in prop
+        }
+        _VAR_MAPPINGS[id(schema)] = mapping
+    return mapping
+
+
+def _partition_variables(processed_data):
+    '''
+    Classifies every distinct variable name in the cleaned records once:
+    top-level fields become (var, schema_field) pairs, array fields
+    become (var, array_name, entry_idx, schema_field) tuples and names
+    the resolver does not know pass through unchanged
+
+    Returns:
+        toplevel, array_specs, passthrough (lists of spec tuples)
+    '''
+    names = set()
+    for record in processed_data.values():
+        names.update(record)
+
+    toplevel = []
+    array_specs = []
+    passthrough = []
+    for var_name in names:
+        try:
+            meta = _rename_cached(var_name)
+        except KeyError:
+            passthrough.append(var_name)
+            continue
+        array_path = meta['array_path']
+        if not array_path:
+            toplevel.append((var_name, meta['schema_field']))
+            continue
+        indices = meta['indices']
+        entry_idx = (indices[0] - 1) if indices else 0
+        array_specs.append((var_name, array_path[0], entry_idx, meta['schema_field']))
+    return toplevel, array_specs, passthrough
+
+
+def _data_keys_by_array(array_specs, index_fields):
+    '''
+    The schema fields carrying data per array, excluding the index
+    fields, pre-bound so the end-of-loop empties filter probes a fixed
+    key set instead of walking every entry's items
+    '''
+    data_keys = {}
+    for _var, array_name, _idx, schema_field in array_specs:
+        if schema_field not in index_fields:
+            data_keys.setdefault(array_name, set()).add(schema_field)
+    return data_keys
+
+
+def _dump_json(obj, path):
+    '''Writes one indented JSON file, preferring orjson when available'''
+    if orjson is not None:
+        try:
+            with open(path, 'wb') as f:
+                f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+            return
+        except TypeError:
+            # orjson rejects non-str keys and odd value types; fall
+            # through to the forgiving stdlib writer
+            pass
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, indent=2, default=str)
+
+
+def load_data(query, conn, logger, chunksize=None):
+    '''
+    Reads one query into a dataframe, or — when chunksize is given —
+    into an iterator of dataframe batches so large result sets never
+    have to be held whole
+    '''
+    if chunksize is None:
+        return read_data(query, conn, logger)
+    logger.info(f'Streaming query in batches of {chunksize}')
+    return pd.read_sql(query, conn, chunksize=chunksize)
+
+
+def pivot_data_streaming(batches):
+    '''
+    Accumulates {StudyID: {VariableName: value}} from an iterator of
+    already-merged long-form batches, so only the pivoted dict and one
+    batch are ever in memory
+
+    Parameters:
+        batches (iterator): dataframes with StudyID/VariableName/ResponseValue
+
+    Returns:
+        pivoted (dict): StudyID -> {VariableName -> raw value}
+    '''
+    pivoted = defaultdict(dict)
+    for batch in batches:
+        if batch.empty:
+            continue
+        for row in batch.itertuples(index=False):
+            pivoted[row.StudyID][row.VariableName] = row.ResponseValue
+    return dict(pivoted)
+
+
+def pivot_data(df, dfQuest):
+    '''
+    Pivots the long-form responses into a participants x variables frame
+    using pandas' C pivot rather than a Python dict-building loop
+
+    Parameters:
+        df (pandas dataframe): StudyID/QuestionID/ResponseValue rows
+        dfQuest (pandas dataframe): QuestionID -> VariableName lookup
+
+    Returns:
+        pivoted (pandas dataframe): StudyID-indexed, one column per variable
+    '''
+    merged = df.merge(dfQuest[['QuestionID', 'VariableName']], on='QuestionID')
+    # resubmissions can duplicate a (participant, variable) pair; the
+    # last response wins, matching the old dict overwrite semantics
+    merged = merged.drop_duplicates(['StudyID', 'VariableName'], keep='last')
+    return merged.pivot(index='StudyID', columns='VariableName',
+                        values='ResponseValue')
+
+
+def _process_flat_frame(pivotedDict, schema, variable_mapping):
+    '''
+    Vectorised cleaning: the pivoted dict becomes a participants x
+    fields frame and every variable is cleaned as column-wide pandas
+    operations instead of one Python call per cell.
+    '''
+    table = _build_field_table(schema, variable_mapping)
+    change_tracking = {}
+
+    if isinstance(pivotedDict, pd.DataFrame):
+        df = pivotedDict
+    else:
+        df = pd.DataFrame.from_dict(pivotedDict, orient='index')
+    out = {}
+
+    for var_name in df.columns:
+        spec = table.get(var_name)
+        orig = df[var_name]
+
+        if spec is None:
+            out[var_name] = orig
+            continue
+
+        if spec.json_key in _BRA_FIELDS or _is_array_int_field(spec.json_key):
+            # the field-specific shapes (bra-cup regex, instance-numbered
+            # ints) stay on the scalar converter so both paths agree;
+            # na_action skips the NaN cells from_dict injects
+            s = orig.map(make_converter(spec), na_action='ignore')
+        else:
+            s = orig
+            if spec.newvalmap_sub:
+                mapped = s.map(spec.newvalmap_sub)
+                s = mapped.where(mapped.notna(), s)
+            s = s.where(~s.isin(cr.nullList), None)
+
+            if spec.expected_type in ('integer', 'number'):
+                num = pd.to_numeric(s, errors='coerce')
+                if spec.expected_type == 'integer':
+                    # int(float(value)) in the scalar converter truncates
+                    num = np.trunc(num)
+                special = num.isin([77777, 88888, 99999])
+                # open bounds are +/-inf in the spec, so both comparisons
+                # are always safe
+                oor = (num < spec.min_val) | (num > spec.max_val)
+                num = num.where(~(oor & ~special), 77777)
+                s = s.mask(num.notna(), num)
+                # the scalar converters deliver integer fields and the
+                # special codes as Python ints, not 3.0/77777.0
+                to_int = (num.notna() if spec.expected_type == 'integer'
+                          else num.isin([77777, 88888, 99999]))
+                if to_int.any():
+                    s = s.astype(object)
+                    s[to_int] = [int(v) for v in num[to_int]]
+
+        changed = orig.astype(str) != s.astype(str)
+        if changed.any():
+            new_values = dict(zip(orig[changed], s[changed]))
+            change_tracking[var_name] = {
+                raw_val: {'count': int(count), 'new_value': new_values[raw_val]}
+                for raw_val, count in orig[changed].value_counts().items()
+            }
+        out[spec.json_key] = s
+
+    # from_dict injected NaN for every (participant, variable) pair the
+    # input never carried; strip those cells so the frame path emits the
+    # same records as the scalar path and no NaN reaches the JSON writers
+    processed_data = {
+        study_id: {key: value for key, value in record.items() if value == value}
+        for study_id, record in pd.DataFrame(out).to_dict(orient='index').items()
+    }
+    return processed_data, change_tracking
+
+
+def process_flat_data(pivotedDict, schema, variable_mapping):
+    '''
+    Cleans every pivoted response value against the flat section schema
+    and tracks the changes made
+
+    Parameters:
+        pivotedDict (dict or pandas dataframe): StudyID -> {VariableName
+            -> raw value}, or the pivoted frame from pivot_data
+        schema (dict): flat section schema (additionalProperties form)
+        variable_mapping (dict): raw variable -> schema field name
+
+    Returns:
+        processed_data (dict): StudyID -> cleaned record
+        change_tracking (dict): variable -> raw value -> count/new value
+    '''
+    if pd is not None:
+        return _process_flat_frame(pivotedDict, schema, variable_mapping)
+
+    table = _build_field_table(schema, variable_mapping)
+    # one specialised converter per field: a single call with no branch
+    # ladder or dict probes left in the per-value path
+    converters = {var: make_converter(spec) for var, spec in table.items()}
+    # flat counters in the hot loop; the nested report shape is
+    # materialised once at the end
+    changes = Counter()
+    new_values = {}
+    processed_data = {}
+
+    # responses are massively repetitive (Y/N/''/bucketed numbers), so
+    # each distinct (variable, raw value) pair is cleaned exactly once
+    value_cache = {}
+    _absent = object()
+
+    for study_id, responses in pivotedDict.items():
+        record = {}
+        for var_name, value in responses.items():
+            spec = table.get(var_name)
+            if spec is None:
+                record[var_name] = value
+                continue
+            try:
+                key = (var_name, value)
+                cleaned_value = value_cache.get(key, _absent)
+                if cleaned_value is _absent:
+                    cleaned_value = converters[var_name](value)
+                    value_cache[key] = cleaned_value
+            except TypeError:
+                # unhashable raw value: clean it directly
+                cleaned_value = converters[var_name](value)
+            # most values clean to themselves, so only fall back to the
+            # allocating string compare when the raw compare differs
+            if value != cleaned_value and str(value) != str(cleaned_value):
+                changes[(var_name, value)] += 1
+                new_values[(var_name, value)] = cleaned_value
+            record[spec.json_key] = cleaned_value
+        processed_data[study_id] = record
+
+    change_tracking = {}
+    for (var_name, value), count in changes.items():
+        change_tracking.setdefault(var_name, {})[value] = {
+            'count': count, 'new_value': new_values[(var_name, value)]}
+    return processed_data, change_tracking
+
+
+# the participant loops are embarrassingly parallel, so the chunk
+# workers receive the precomputed spec tables once via the pool
+# initializer (mirroring restructure_utils) rather than per task
+_FLAT_POOL_STATE = None
+
+
+def _flat_pool_init(kind, specs):
+    global _FLAT_POOL_STATE
+    _FLAT_POOL_STATE = (kind, specs)
+
+
+def _flat_chunk_worker(items):
+    kind, specs = _FLAT_POOL_STATE
+    if kind == 'physical_dev':
+        return _physical_dev_chunk(items, *specs)
+    return _pregnancies_chunk(items, *specs)
+
+
+def _fanout_restructure(processed_data, kind, specs, chunk_fn, workers):
+    '''Runs chunk_fn serially or over a process pool of participant chunks'''
+    items = list(processed_data.items())
+    if workers <= 1 or len(items) < 2 * _FLAT_CHUNK:
+        return chunk_fn(items, *specs)
+    chunks = [items[i:i + _FLAT_CHUNK] for i in range(0, len(items), _FLAT_CHUNK)]
+    restructured = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_flat_pool_init,
+                             initargs=(kind, specs)) as executor:
+        for part in executor.map(_flat_chunk_worker, chunks):
+            restructured.update(part)
+    return restructured
+
+
+_FLAT_CHUNK = 2000
+
+
+def restructure_physical_dev(processed_data, workers=1):
+    '''
+    Rebuilds the RecordedHeights and Institutions arrays from the flat
+    instance-suffixed PhysicalDevelopment fields
+
+    Parameters:
+        processed_data (dict): StudyID -> cleaned flat record
+        workers (int): process count for fanning out participant chunks
+
+    Returns:
+        restructured (dict): StudyID -> record with nested arrays
+    '''
+    toplevel, array_specs, passthrough = _partition_variables(processed_data)
+    data_keys = _data_keys_by_array(array_specs, {'R0_RecHeight_Num', 'R0_Inst_Num'})
+    specs = (toplevel, array_specs, passthrough,
+             data_keys.get('RecordedHeights', set()),
+             data_keys.get('Institutions', set()))
+    return _fanout_restructure(processed_data, 'physical_dev', specs,
+                               _physical_dev_chunk, workers)
+
+
+def _physical_dev_chunk(items, toplevel, array_specs, passthrough, rh_keys, inst_keys):
+    restructured = {}
+
+    for participant_id, record in items:
+        # the questionnaire asks for at most 3 recorded heights and 2
+        # institutions, so the arrays are pre-sized with their index
+        # fields in place and writes land by position
+        json_data = {
+            'R0_StudyID': participant_id,
+            'RecordedHeights': [{'R0_RecHeight_Num': i + 1} for i in range(3)],
+            'Institutions': [{'R0_Inst_Num': i + 1} for i in range(2)],
+        }
+
+        for var_name in passthrough:
+            value = record.get(var_name)
+            if value is not None:
+                json_data[var_name] = value
+        for var_name, schema_field in toplevel:
+            value = record.get(var_name)
+            if value is not None:
+                json_data[schema_field] = value
+        for var_name, array_name, entry_idx, schema_field in array_specs:
+            value = record.get(var_name)
+            if value is None:
+                continue
+            lst = json_data.setdefault(array_name, [])
+            if entry_idx >= len(lst):
+                lst.extend({} for _ in range(entry_idx + 1 - len(lst)))
+            lst[entry_idx][schema_field] = value
+
+        json_data['RecordedHeights'] = [
+            e for e in json_data['RecordedHeights']
+            if any(e.get(k) is not None for k in rh_keys)
+        ]
+        json_data['Institutions'] = [
+            e for e in json_data['Institutions']
+            if any(e.get(k) is not None for k in inst_keys)
+        ]
+
+        restructured[participant_id] = json_data
+
+    return restructured
+
+
+def restructure_pregnancies(processed_data, workers=1):
+    '''
+    Rebuilds the Pregnancies array from the flat instance-suffixed
+    Pregnancies fields
+
+    Parameters:
+        processed_data (dict): StudyID -> cleaned flat record
+        workers (int): process count for fanning out participant chunks
+
+    Returns:
+        restructured (dict): StudyID -> record with the nested array
+    '''
+    toplevel, array_specs, passthrough = _partition_variables(processed_data)
+    preg_keys = _data_keys_by_array(array_specs, {'R0_PregNum'}).get('Pregnancies', set())
+    specs = (toplevel, array_specs, passthrough, preg_keys)
+    return _fanout_restructure(processed_data, 'pregnancies', specs,
+                               _pregnancies_chunk, workers)
+
+
+def _pregnancies_chunk(items, toplevel, array_specs, passthrough, preg_keys):
+    restructured = {}
+
+    for participant_id, record in items:
+        json_data = {'R0_StudyID': participant_id, 'Pregnancies': []}
+
+        for var_name in passthrough:
+            value = record.get(var_name)
+            if value is not None:
+                json_data[var_name] = value
+        for var_name, schema_field in toplevel:
+            value = record.get(var_name)
+            if value is not None:
+                json_data[schema_field] = value
+        for var_name, _array_name, entry_idx, schema_field in array_specs:
+            value = record.get(var_name)
+            if value is None:
+                continue
+            lst = json_data['Pregnancies']
+            if entry_idx >= len(lst):
+                lst.extend({} for _ in range(entry_idx + 1 - len(lst)))
+            lst[entry_idx][schema_field] = value
+
+        for i, entry in enumerate(json_data['Pregnancies']):
+            entry.setdefault('R0_PregNum', i + 1)
+        json_data['Pregnancies'] = [
+            e for e in json_data['Pregnancies']
+            if any(e.get(k) is not None for k in preg_keys)
+        ]
+
+        restructured[participant_id] = json_data
+
+    return restructured
+
+
+def process_flat_section(q_sect, schema_file, question_range, logger):
+    '''
+    Runs the flat processing for one section end to end
+
+    Parameters:
+        q_sect (string): section name, e.g. "PhysicalDevelopment"
+        schema_file (string): flat schema file name
+        question_range (tuple): (low, high) QuestionID range
+        logger (logging): logger object to log the statements
+
+    Returns:
+        processed_data (dict): StudyID -> minimally processed record
+    '''
+    conn = connect_DB('Questionnaire', cf.live_server, logger)
+    lo, hi = question_range
+
+    dfQuest = load_data(
+        f'SELECT QuestionID, VariableName FROM Questions '
+        f'WHERE QuestionID BETWEEN {lo} AND {hi}', conn, logger)
+    dfFlag = load_data(
+        f'SELECT VariableName, PII FROM VariableFlagging '
+        f'WHERE QuestionID BETWEEN {lo} AND {hi}', conn, logger)
+
+    # the responses table is the big one: stream it in batches and fold
+    # each straight into the pivot so the long-form frame and the
+    # pivoted dict never coexist in full
+    batches = load_data(
+        f'SELECT StudyID, QuestionID, ResponseValue FROM GeneralResponses '
+        f'WHERE RoundID = 1 AND QuestionID BETWEEN {lo} AND {hi}',
+        conn, logger, chunksize=100_000)
+    quest_lookup = dfQuest[['QuestionID', 'VariableName']]
+
+    schema = load_schema(os.path.join(cf.r0_json_path, schema_file))
+    variable_mapping = _variable_mapping_for(schema)
+
+    pivotedDict = pivot_data_streaming(
+        batch.merge(quest_lookup, on='QuestionID') for batch in batches)
+    processed_data, change_tracking = process_flat_data(pivotedDict, schema, variable_mapping)
+
+    if q_sect == 'PhysicalDevelopment':
+        processed_data = restructure_physical_dev(processed_data)
+    elif q_sect == 'Pregnancies':
+        processed_data = restructure_pregnancies(processed_data)
+
+    # resolve the flagged variables to schema columns once; pop is a
+    # single probe per (participant, column) versus the old if-in + del
+    pii_cols = [variable_mapping.get(v, v)
+                for v in dfFlag.loc[dfFlag['PII'] == 1, 'VariableName']]
+    for participant in processed_data.values():
+        for col in pii_cols:
+            participant.pop(col, None)
+
+    os.makedirs(cf.out_json_path, exist_ok=True)
+    os.makedirs(cf.ct_path, exist_ok=True)
+    _dump_json(processed_data, os.path.join(cf.out_json_path, f'{q_sect}_minimal.json'))
+    _dump_json(change_tracking,
+               os.path.join(cf.ct_path, f'{q_sect}_flat_change_tracking.json'))
+
+    return processed_data
@@ -0,0 +1,412 @@
+# nested_utils.py
+#
+# Resolver between flat questionnaire column names and their position in
+# the nested R0 section schemas. Flat columns carry instance suffixes
+# (e.g. R0_Preg_EndDay_4, Q5_14_10_1, Gen07_full@Q5_13_D_10) that encode
+# which array slot the value belongs to; rename_variable maps such a name
+# back to its schema field, owning section and array path so the
+# restructuring step can place it. The resolver cache builders persist
+# the per-section {R0_leaf: {raw columns}} indices used by validation.
+
+import os
+import sys
+import json
+import re
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+_CFG_PATH = os.path.abspath(
+    "N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"
+)
+if _CFG_PATH not in sys.path:
+    sys.path.insert(0, _CFG_PATH)
+
+from config import r0_json_path, validation_path
+
+
+_SOURCE_SEP = "@"
+_INSTANCE_RE = re.compile(r"^(?P<base>.+?)_(?P<idx>\d+)(?:_(?P<child>\d+))?$")
+
+
+def _as_tuple(x):
+    """Immutable (and shareable) view of a possibly-absent sequence."""
+    return tuple(x) if x else ()
+
+
+@lru_cache(maxsize=512)
+def _norm_section(s):
+    """Normalise a section label for comparison (case/underscore folding)."""
+    return (s or "").replace("_", "").replace("-", "").lower()
+
+
+# ------------------------------------------------------------
+# Variable index (built lazily from the raw section schemas)
+# ------------------------------------------------------------
+
+_variable_index = None
+
+
+def _build_variable_index() -> dict:
+    """
+    Walk every raw section schema and map each leaf's base name (its
+    x-name, falling back to the property key) to the metadata needed to
+    place an instance of it: schema field, section and array path.
+    """
+    index = {}
+
+    def add(base, field, section, array_path):
+        if base and base not in index:
+            index[base] = {
+                "schema_field": field,
+                "section": section,
+                "array_path": _as_tuple(array_path),
+            }
+
+    for fname in sorted(os.listdir(r0_json_path)):
+        if not fname.endswith("_Schema.json"):
+            continue
+        section = fname[: -len("_Schema.json")]
+        with open(os.path.join(r0_json_path, fname), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+
+        for key, prop in (schema.get("properties") or {}).items():
+            t = prop.get("type")
+            is_array = t == "array" or (isinstance(t, list) and "array" in t)
+            if not is_array:
+                add(prop.get("x-name") or key, key, section, [])
+                continue
+            item_props = (prop.get("items") or {}).get("properties") or {}
+            for key2, prop2 in item_props.items():
+                t2 = prop2.get("type")
+                is_array2 = t2 == "array" or (isinstance(t2, list) and "array" in t2)
+                if not is_array2:
+                    add(prop2.get("x-name") or key2, key2, section, [key])
+                    continue
+                child_props = (prop2.get("items") or {}).get("properties") or {}
+                for key3, prop3 in child_props.items():
+                    add(prop3.get("x-name") or key3, key3, section, [key, key2])
+
+    return index
+
+
+def _variable_index_loaded() -> dict:
+    global _variable_index
+    if _variable_index is None:
+        _variable_index = _build_variable_index()
+    return _variable_index
+
+
+def rename_variable(raw: str) -> dict:
+    """
+    Resolve a flat column name to its schema placement metadata.
+
+    Returns:
+        dict with schema_field, section, array_path (list), indices
+        (list of int instance numbers, outermost first) and index_label
+        (the raw instance name). Raises KeyError for unknown names.
+    """
+    index = _variable_index_loaded()
+
+    name = raw.split(_SOURCE_SEP, 1)[1] if _SOURCE_SEP in raw else raw
+
+    meta = index.get(name)
+    if meta is not None:
+        return {
+            "schema_field": meta["schema_field"],
+            "section": meta["section"],
+            "array_path": meta["array_path"],
+            "indices": (),
+            "index_label": raw,
+        }
+
+    m = _INSTANCE_RE.match(name)
+    while m:
+        base = m.group("base")
+        meta = index.get(base)
+        if meta is not None and meta["array_path"]:
+            if m.group("child") is not None:
+                indices = (int(m.group("idx")), int(m.group("child")))
+            elif len(meta["array_path"]) == 2:
+                # a single suffix on a two-level leaf indexes the child array
+                indices = (1, int(m.group("idx")))
+            else:
+                indices = (int(m.group("idx")),)
+            return {
+                "schema_field": meta["schema_field"],
+                "section": meta["section"],
+                "array_path": meta["array_path"],
+                "indices": indices[: len(meta["array_path"])],
+                "index_label": raw,
+            }
+        m = _INSTANCE_RE.match(base)
+
+    raise KeyError(raw)
+
+
+# ------------------------------------------------------------
+# Resolver cache builders
+# ------------------------------------------------------------
+
+def _summary_dir(section_slug: str) -> str:
+    return os.path.join(validation_path, f"{section_slug}_ValidationSummary")
+
+
+# The persisted index files predate this module and carry per-section
+# stems; runs must refresh those artifacts, not write parallel files
+# beside them, so the irregular stems are pinned here and the regular
+# ones fall back to the lowercased slug.
+_INDEX_FILE_STEMS = {
+    "AlcoholSmokingDiet": "alcohol_smoking_diet",
+    "BirthDetails": "birth_details",
+    "BreastDisease": "breast_disease",
+    "CancerRelatives": "cancer_relatives",
+    "ContraceptiveHRT": "contraceptive_hrt",
+    "GeneralInformation": "general_information",
+    "MenstrualMenopause": "menstrual_menopause",
+    "MH_CancersBenignTumors": "cancers_benign_tumors",
+    "MH_DrugsSupplements": "drugs_supplements",
+    "MH_Illnesses": "mh_illnesses",
+    "OtherBreastSurgery": "other_breast_surgery",
+    "OtherLifestyleFactors": "other_lifestyle_factors",
+    "PhysicalActivity": "physical_activity",
+    "PhysicalDevelopment": "physical_dev",
+    "XRays": "xrays",
+}
+
+
+def _index_filename(section_slug: str) -> str:
+    """The persisted resolver-index file name for one section."""
+    if _norm_section(section_slug) == "breastcancer":
+        return "breastcancer_resolver_index_nested.json"
+    stem = _INDEX_FILE_STEMS.get(section_slug, section_slug.lower())
+    return f"{stem}_resolver_index.json"
+
+
+# Directories already created this run; saves repeated makedirs/isdir
+# syscalls when the builders fire once per section per batch.
+_ensured_dirs: set = set()
+
+
+def _ensure_dir(path: str):
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
+
+
+def _write_index(index: dict, json_path: str):
+    """Serialise once and hand the payload to a single buffered write."""
+    if orjson is not None:
+        with open(json_path, "wb") as f:
+            f.write(orjson.dumps(index, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        return
+    payload = json.dumps(index, indent=2, ensure_ascii=False)
+    with open(json_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write(payload)
+
+
+def build_resolver_cache_from_columns(raw_columns, section_slug: str, cache_dir: str | None = None,
+                                      section_prefixes: tuple | None = None) -> dict:
+    """
+    Build the {R0_leaf: {"all": [raw cols], label: [raw col]}} resolver
+    index for one section from the flat column names and persist it next
+    to the section's validation summary. section_prefixes, when given,
+    rules out obviously-foreign columns with one startswith call before
+    any resolver dispatch.
+    """
+    sect_norm = _norm_section(section_slug)
+    index: dict = {}
+
+    cols = map(str, raw_columns)
+    if section_prefixes is not None:
+        prefixes = tuple(section_prefixes)
+        cols = (c for c in cols if c.startswith(prefixes))
+
+    for col in cols:
+        try:
+            meta = rename_variable(col)
+        except KeyError:
+            continue
+        if _norm_section(meta.get("section")) != sect_norm:
+            continue
+        field = meta.get("schema_field")
+        d = index.setdefault(field, {})
+        # sets de-dup at insert time; the flush sort imposes the order
+        d.setdefault("all", set()).add(col)
+        # instance buckets carry the plain instance number (innermost
+        # index) as their label, matching the persisted artifacts
+        indices = meta.get("indices")
+        if indices:
+            d.setdefault(str(indices[-1]), set()).add(col)
+
+    # flush: buckets are already unique, one sort each
+    for r0, mapping in index.items():
+        for k, cols in mapping.items():
+            mapping[k] = sorted(cols)
+
+    gen_val_path = cache_dir or _summary_dir(section_slug)
+    _ensure_dir(gen_val_path)
+    json_path = os.path.join(gen_val_path, _index_filename(section_slug))
+    _write_index(index, json_path)
+
+    return index
+
+
+# Per-column placement closures for the BreastCancer builder: the 3-case
+# branch tree runs once per column ever, after which repeat builds do a
+# single dict lookup plus one call.
+_bc_dispatch: dict = {}
+_BC_MISSING = object()
+
+
+def _bc_case_fn(meta):
+    """Pick and bind the placement closure for one resolved column."""
+    field = meta.get("schema_field")
+    array_path = _as_tuple(meta.get("array_path"))
+    indices = _as_tuple(meta.get("indices"))
+    if len(array_path) == 1 and indices:
+        # Case 2: tumour-level leaf — a plain instance-number bucket,
+        # same labelling as the flat sections
+        def place(col, index, _field=field, _label=str(indices[0])):
+            d = index.setdefault(_field, {})
+            d.setdefault("all", set()).add(col)
+            d.setdefault(_label, set()).add(col)
+    elif len(array_path) == 2 and len(indices) == 2:
+        # Case 3: drug-episode leaf — nested per-tumour buckets, each
+        # with its own 'all' plus one bucket per episode, matching the
+        # persisted nested index
+        def place(col, index, _field=field, _bc=str(indices[0]), _ep=str(indices[1])):
+            d = index.setdefault(_field, {})
+            d.setdefault("all", set()).add(col)
+            bucket = d.setdefault(_bc, {})
+            bucket.setdefault("all", set()).add(col)
+            bucket.setdefault(_ep, set()).add(col)
+    else:
+        # Case 1: top-level scalar, only the 'all' bucket applies
+        def place(col, index, _field=field):
+            index.setdefault(_field, {}).setdefault("all", set()).add(col)
+    return place
+
+
+def _bc_warm_dispatch(pending, sect_norm):
+    """
+    Classify many unseen columns in one pass. The instance-suffix regex
+    runs vectorised over a pandas Series (one C call for the whole batch)
+    and the per-column remainder is plain dict lookups; shapes the batch
+    parse cannot cover fall back to the scalar resolver.
+    """
+    index = _variable_index_loaded()
+    s = pd.Series(pending, dtype=object)
+    names = s.str.split(_SOURCE_SEP).str[-1]
+    ex = names.str.extract(_INSTANCE_RE)
+
+    for col, name, base, idx, child in zip(pending, names, ex["base"], ex["idx"], ex["child"]):
+        meta = index.get(name)
+        if meta is not None:
+            m = {
+                "schema_field": meta["schema_field"],
+                "section": meta["section"],
+                "array_path": meta["array_path"],
+                "indices": (),
+            }
+        else:
+            m = None
+            if isinstance(base, str):
+                bmeta = index.get(base)
+                if bmeta is not None and bmeta["array_path"]:
+                    if isinstance(child, str):
+                        indices = (int(idx), int(child))
+                    elif len(bmeta["array_path"]) == 2:
+                        indices = (1, int(idx))
+                    else:
+                        indices = (int(idx),)
+                    m = {
+                        "schema_field": bmeta["schema_field"],
+                        "section": bmeta["section"],
+                        "array_path": bmeta["array_path"],
+                        "indices": indices[: len(bmeta["array_path"])],
+                    }
+            if m is None:
+                try:
+                    m = rename_variable(col)
+                except KeyError:
+                    m = None
+
+        if m is None or _norm_section(m.get("section")) != sect_norm:
+            _bc_dispatch[col] = None
+        else:
+            _bc_dispatch[col] = _bc_case_fn(m)
+
+
+def build_breast_cancer_resolver_cache(raw_columns, cache_dir: str | None = None,
+                                       section_prefixes: tuple | None = None) -> dict:
+    """
+    BreastCancer variant of the resolver index builder. The section nests
+    two levels deep (BreastCancers -> DrugTreatment), so buckets are kept
+    per tumour instance (BC<n>) and per drug episode (BC<n>_<m>) as well
+    as the flat 'all' bucket. Pass section_prefixes (e.g. ("Q7_",)) to
+    skip resolution of columns that cannot belong to the section.
+    """
+    sect_norm = _norm_section("BreastCancer")
+    index: dict = {}
+
+    cols = map(str, raw_columns)
+    if section_prefixes is not None:
+        prefixes = tuple(section_prefixes)
+        cols = (c for c in cols if c.startswith(prefixes))
+    cols = list(cols)
+
+    # Cold caches with many columns classify far faster in one vectorised
+    # batch than through per-column regex matching.
+    pending = [c for c in cols if c not in _bc_dispatch]
+    if pd is not None and len(pending) > 64:
+        _bc_warm_dispatch(pending, sect_norm)
+
+    for col in cols:
+        fn = _bc_dispatch.get(col, _BC_MISSING)
+        if fn is _BC_MISSING:
+            try:
+                meta = rename_variable(col)
+            except KeyError:
+                meta = None
+            if meta is None or _norm_section(meta.get("section")) != sect_norm:
+                fn = None
+            else:
+                fn = _bc_case_fn(meta)
+            _bc_dispatch[col] = fn
+        if fn is not None:
+            fn(col, index)
+
+    for r0, mapping in index.items():
+        for k, v in mapping.items():
+            if isinstance(v, dict):
+                for k2, cols in v.items():
+                    v[k2] = sorted(cols)
+            else:
+                mapping[k] = sorted(v)
+
+    gen_val_path = cache_dir or _summary_dir("BreastCancer")
+    _ensure_dir(gen_val_path)
+    json_path = os.path.join(gen_val_path, _index_filename("BreastCancer"))
+    _write_index(index, json_path)
+
+    return index
+
+
+def load_resolver_cache(section_slug: str, cache_dir: str | None = None) -> dict:
+    """Load a previously persisted resolver index for a section."""
+    gen_val_path = cache_dir or _summary_dir(section_slug)
+    json_path = os.path.join(gen_val_path, _index_filename(section_slug))
+    if orjson is not None:
+        with open(json_path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,235 @@
+# processing_utils.py
+#
+# Per-value cleaning helpers for the minimally processed flat R0
+# outputs: type coercion against the section schema, the agreed recodes
+# and special codes, plus a handful of field-specific rules.
+
+import os
+import re
+import sys
+from functools import lru_cache
+
+_CFG_PATH = os.path.abspath(
+    "N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"
+)
+if _CFG_PATH not in sys.path:
+    sys.path.insert(0, _CFG_PATH)
+
+import cleaning_rules as cr
+
+
+class FieldSpec:
+    '''Resolved cleaning metadata for one raw variable.'''
+
+    __slots__ = ('json_key', 'expected_type', 'min_val', 'max_val', 'newvalmap_sub')
+
+    def __init__(self, json_key, expected_type, min_val, max_val, newvalmap_sub):
+        self.json_key = json_key
+        self.expected_type = expected_type
+        self.min_val = min_val
+        self.max_val = max_val
+        self.newvalmap_sub = newvalmap_sub
+
+
+def _minmax_from_schema(field_schema):
+    '''The numeric range for a field schema, walking anyOf when present'''
+    min_val = field_schema.get('minimum')
+    max_val = field_schema.get('maximum')
+    if 'anyOf' in field_schema:
+        for subschema in field_schema['anyOf']:
+            if 'minimum' in subschema or 'maximum' in subschema:
+                min_val = subschema.get('minimum')
+                max_val = subschema.get('maximum')
+                break
+    return min_val, max_val
+
+
+def _build_field_table(schema, variable_mapping):
+    '''
+    Resolves the per-variable cleaning metadata once per section: the
+    schema field name, expected type, numeric range and the recode
+    sub-map, so the per-cell path never touches the schema dict
+
+    Parameters:
+        schema (dict): flat section schema (additionalProperties form)
+        variable_mapping (dict): raw variable -> schema field name
+
+    Returns:
+        table (dict): raw variable name -> FieldSpec
+    '''
+    props = schema['additionalProperties']['properties']
+    reverse = {json_key: var for var, json_key in variable_mapping.items()}
+
+    table = {}
+    for json_key, field_schema in props.items():
+        var_name = reverse.get(json_key, json_key)
+        expected_type = field_schema.get('type')
+        if isinstance(expected_type, list):
+            expected_type = expected_type[0]
+        min_val, max_val = _minmax_from_schema(field_schema)
+        # open bounds become +/-inf so the range check is a plain pair of
+        # comparisons and a 0 bound is not mistaken for "no bound"
+        if min_val is None:
+            min_val = float('-inf')
+        if max_val is None:
+            max_val = float('inf')
+        sub = cr.newValMap.get(json_key)
+        if sub is None:
+            sub = cr.newValMap.get(var_name)
+        table[var_name] = FieldSpec(json_key, expected_type, min_val, max_val, sub)
+    return table
+
+
+# sentinel distinguishing "no recode for this value" from a recode to None
+_MISS = object()
+
+_SPECIAL_CODES = frozenset({77777, 88888, 99999})
+
+# bra cup sizes are free-text but follow a fixed shape: band+cup (34B)
+# or cup letters alone (DD)
+_BRA_CUP_RE = re.compile(r"\d{2}[A-Z]{1,2}|[A-Z]{1,3}")
+_BRA_FIELDS = frozenset({'R0_BraCupSize_Other', 'R0_BraCupSize_20Other'})
+
+_ARRAY_INT_PREFIXES = ('R0_RecHght', 'R0_Institution', 'R0_AgeMeas')
+
+
+@lru_cache(maxsize=None)
+def _is_array_int_field(field_name):
+    '''One prefix scan per distinct field name; repeats hit the cache'''
+    return field_name.startswith(_ARRAY_INT_PREFIXES)
+
+
+def convert_value(value, field_name, var_name, expected_type, min_val, max_val,
+                  newvalmap_sub=None, _special=_SPECIAL_CODES):
+    '''
+    Cleans one response value: field-specific shapes first, then the
+    recode map, null strings, and finally numeric coercion with the
+    special codes and schema range applied
+
+    Parameters:
+        value: raw response value
+        field_name (string): schema field name
+        var_name (string): raw variable name
+        expected_type (string): JSON type from the schema
+        min_val, max_val: numeric range from the schema (-inf/+inf = open)
+        newvalmap_sub (dict): pre-resolved recode sub-map for this field,
+            or None when the field has no recodes
+
+    Returns:
+        the cleaned value (77777 for out-of-range numerics)
+    '''
+    if field_name in _BRA_FIELDS:
+        cleaned_value = str(value).strip().upper()
+        if _BRA_CUP_RE.fullmatch(cleaned_value):
+            return cleaned_value
+        return None
+
+    if newvalmap_sub is not None:
+        mapped = newvalmap_sub.get(value, _MISS)
+        if mapped is not _MISS:
+            return mapped
+
+    if value in cr.nullList:
+        return None
+
+    if expected_type == 'integer':
+        try:
+            converted = int(float(value))
+        except (TypeError, ValueError):
+            return value
+        if converted in _special:
+            return converted
+        if converted < min_val or converted > max_val:
+            return 77777
+        return converted
+
+    if expected_type == 'number':
+        try:
+            converted = float(value)
+        except (TypeError, ValueError):
+            return value
+        if converted in _special:
+            return int(converted)
+        if converted < min_val or converted > max_val:
+            return 77777
+        return converted
+
+    # instance-numbered array fields come out of the pivot as strings
+    if _is_array_int_field(field_name):
+        cleaned_value = str(value).strip()
+        if cleaned_value.isdigit():
+            return int(cleaned_value)
+
+    return value
+
+
+def convert_flat_value(value, spec, var_name):
+    '''
+    Cleans one value using its pre-resolved FieldSpec, delegating to
+    convert_value with the already-extracted type and range
+    '''
+    return convert_value(value, spec.json_key, var_name, spec.expected_type,
+                         spec.min_val, spec.max_val, spec.newvalmap_sub)
+
+
+def make_converter(spec):
+    '''
+    Builds a specialised converter for one field, closing over only the
+    branches that field can take — the generic convert_value ladder
+    re-tests every branch per value, the closure tests none it cannot hit
+
+    Parameters:
+        spec (FieldSpec): pre-resolved cleaning metadata for the field
+
+    Returns:
+        convert (callable): raw value -> cleaned value
+    '''
+    sub = spec.newvalmap_sub
+    null_list = cr.nullList
+    mn = spec.min_val
+    mx = spec.max_val
+
+    if spec.json_key in _BRA_FIELDS:
+        def convert(value, _re=_BRA_CUP_RE):
+            cleaned = str(value).strip().upper()
+            if _re.fullmatch(cleaned):
+                return cleaned
+            return None
+        return convert
+
+    if spec.expected_type in ('integer', 'number'):
+        is_int = spec.expected_type == 'integer'
+
+        def convert(value, _special=_SPECIAL_CODES):
+            if sub is not None:
+                mapped = sub.get(value, _MISS)
+                if mapped is not _MISS:
+                    return mapped
+            if value in null_list:
+                return None
+            try:
+                converted = int(float(value)) if is_int else float(value)
+            except (TypeError, ValueError):
+                return value
+            if converted in _special:
+                return int(converted)
+            if converted < mn or converted > mx:
+                return 77777
+            return converted
+        return convert
+
+    array_int = _is_array_int_field(spec.json_key)
+
+    def convert(value):
+        if sub is not None:
+            mapped = sub.get(value, _MISS)
+            if mapped is not _MISS:
+                return mapped
+        if value in null_list:
+            return None
+        if array_int:
+            cleaned = str(value).strip()
+            if cleaned.isdigit():
+                return int(cleaned)
+        return value
+    return convert
@@ -0,0 +1,733 @@
+# restructure_utils.py
+#
+# Rebuild the nested R0 section structure from flat processed records.
+# Each record arrives as a flat dict of column -> value; the section
+# schema describes which leaves live at the top level, which belong to a
+# repeated array (Pregnancies, BreastCancers, ...) and which sit inside a
+# child array (DrugTreatment). Placement metadata for instance-suffixed
+# columns comes from the nested_utils resolver.
+
+import os
+import sys
+import json
+import pickle
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Add the deployment paths once; repeat imports of this module must not
+# keep lengthening sys.path (every later import pays for the scan).
+for _p in (
+    os.path.abspath("N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"),
+    os.path.abspath("N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils\\Questionnaire\\R0\\scripts"),
+):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import nested_utils as nv
+
+# The same raw names resolve over and over across the 19 section
+# wrappers and repeated runs; identical keys short-circuit to the cached
+# meta instead of re-entering the resolver.
+_resolve_cached = lru_cache(maxsize=None)(nv.rename_variable)
+
+
+@lru_cache(maxsize=None)
+def _resolve_tuple(raw, sect_norm, schema_leaves):
+    """Raw name -> coerced (array_path, indices, field, label) tuple.
+
+    Caching the coerced form (not just the resolver's meta dict) means a
+    key seen again for the same section skips the coercion as well.
+    """
+    try:
+        meta = _resolve_cached(raw)
+    except KeyError:
+        return None
+    return _coerce_meta(meta, sect_norm, schema_leaves)
+
+
+def clear_resolver_cache():
+    _resolve_cached.cache_clear()
+    _resolve_tuple.cache_clear()
+
+
+_EMPTY = (None, "", [], {})
+
+# Raw columns that never resolve to a section leaf; ruled out before the
+# resolver is consulted.
+_SKIP_RAWS = frozenset(("R0_StudyID", "R0_TCode"))
+
+
+def looks_like_index_field(key: str) -> bool:
+    """
+    True for array index leaves (R0_Preg_Num, R0_DrugTreatment_Num, ...).
+    Equivalent to re.search(r'Num($|_)', key, re.I) without the regex
+    engine entry cost, which matters inside the schema walks.
+    """
+    k = key[3:] if key.startswith("R0_") else key
+    i = k.lower().find("num")
+    if i < 0:
+        return False
+    j = i + 3
+    return j == len(k) or k[j] == "_"
+
+
+@dataclass(frozen=True)
+class SchemaFacts:
+    """Pre-computed introspection results for one section schema."""
+    leaf_index: Dict[str, tuple]
+    schema_leaves: frozenset
+    toplevel_arrays: tuple
+    index_field_by_array: Dict[str, str]
+    child_max: Dict[str, int]
+    toplevel_leaves: frozenset
+    leaf_to_arr1: Dict[str, str]
+
+
+# restructure_by_schema is called once per section wrapper and often many
+# times per run; the schema objects are loaded once and reused, so the
+# introspection walks are cached on the identity of the schema dict.
+# Entries pin the schema alongside its facts: the strong reference keeps
+# the id alive, so a dropped schema's id cannot be recycled onto a
+# different dict and alias its facts.
+_SCHEMA_FACTS_CACHE: Dict[int, Tuple[dict, SchemaFacts]] = {}
+
+
+def clear_schema_cache():
+    _SCHEMA_FACTS_CACHE.clear()
+
+
+# Section labels come from a small fixed set, so the two string
+# allocations per call collapse into cache hits almost immediately.
+@lru_cache(maxsize=512)
+def _norm_section(s):
+    return (s or "").replace("_", "").replace("-", "").lower()
+
+
+def _is_array(prop):
+    t = prop.get("type")
+    return t == "array" or (isinstance(t, list) and "array" in t)
+
+
+def _discover_toplevel_arrays(schema):
+    return tuple(
+        k for k, v in (schema.get("properties") or {}).items() if _is_array(v)
+    )
+
+
+def _build_leaf_index(schema):
+    """leaf name -> array path tuple ((), (arr,), or (arr, child))."""
+    leaf_index = {}
+
+    # Leaf and array names end up as dict keys on every record; interning
+    # them gives the pointer-equality fast path on key comparisons.
+    stack = [(schema.get("properties") or {}, ())]
+    while stack:
+        props, arrays = stack.pop()
+        for k, v in props.items():
+            if _is_array(v):
+                stack.append(((v.get("items") or {}).get("properties") or {},
+                              arrays + (sys.intern(k),)))
+            else:
+                leaf_index[sys.intern(k)] = arrays
+    return leaf_index
+
+
+def _index_fields_by_array(schema):
+    """array name -> its index field (the *Num leaf), where present."""
+    out = {}
+    stack = [(schema.get("properties") or {}, ())]
+    while stack:
+        props, arrays = stack.pop()
+        for k, v in props.items():
+            if _is_array(v):
+                stack.append(((v.get("items") or {}).get("properties") or {},
+                              arrays + (k,)))
+            elif arrays and looks_like_index_field(k):
+                out.setdefault(arrays[-1], k)
+    return out
+
+
+def _child_maxitems_map(schema):
+    """child array name -> maxItems cap, where declared."""
+    out = {}
+    stack = [schema.get("properties") or {}]
+    while stack:
+        props = stack.pop()
+        for k, v in props.items():
+            if _is_array(v):
+                if v.get("maxItems") is not None:
+                    out[k] = v["maxItems"]
+                stack.append((v.get("items") or {}).get("properties") or {})
+    return out
+
+
+def _build_schema_facts(schema: dict) -> SchemaFacts:
+    leaf_index = _build_leaf_index(schema)
+    return SchemaFacts(
+        leaf_index=leaf_index,
+        schema_leaves=frozenset(leaf_index),
+        toplevel_arrays=_discover_toplevel_arrays(schema),
+        index_field_by_array=_index_fields_by_array(schema),
+        child_max=_child_maxitems_map(schema),
+        toplevel_leaves=frozenset(k for k, v in leaf_index.items() if not v),
+        leaf_to_arr1={k: v[0] for k, v in leaf_index.items() if len(v) == 1},
+    )
+
+
+def _schema_facts(schema: dict, schema_path: Optional[str] = None) -> SchemaFacts:
+    entry = _SCHEMA_FACTS_CACHE.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        return entry[1]
+    if schema_path is not None:
+        facts = _schema_facts_disk_cache(schema_path, schema)
+    else:
+        facts = _build_schema_facts(schema)
+    _SCHEMA_FACTS_CACHE[id(schema)] = (schema, facts)
+    return facts
+
+
+_FACTS_DISK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".schema_facts_cache")
+
+
+def _schema_facts_disk_cache(schema_path: str, schema: Optional[dict] = None) -> SchemaFacts:
+    """
+    Schema facts with a cross-process warm cache. The driver runs one
+    process per section, so the in-memory cache starts cold every time;
+    facts are pickled under a (path, mtime) key and reloaded as long as
+    the schema file has not changed. The already-parsed schema, when
+    given, saves re-reading the file on a miss.
+    """
+    key = (os.path.abspath(schema_path), os.path.getmtime(schema_path))
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    pkl_path = os.path.join(_FACTS_DISK_DIR, f"schema_facts_{digest}.pkl")
+    try:
+        with open(pkl_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    if schema is None:
+        with open(schema_path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+    facts = _build_schema_facts(schema)
+    try:
+        os.makedirs(_FACTS_DISK_DIR, exist_ok=True)
+        with open(pkl_path, "wb") as f:
+            pickle.dump(facts, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # read-only location: recompute next process
+    return facts
+
+
+def _resolved_meta_cache_path(section_slug: str, col_hash: str) -> str:
+    return os.path.join(_FACTS_DISK_DIR, f"resolved_{section_slug.lower()}_{col_hash}.pkl")
+
+
+def _load_resolved_meta_cache(section_slug: str, col_hash: str):
+    try:
+        with open(_resolved_meta_cache_path(section_slug, col_hash), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _store_resolved_meta_cache(section_slug: str, col_hash: str, resolved_meta: dict):
+    try:
+        os.makedirs(_FACTS_DISK_DIR, exist_ok=True)
+        with open(_resolved_meta_cache_path(section_slug, col_hash), "wb") as f:
+            pickle.dump(resolved_meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+
+def _coerce_meta(meta, sect_norm, schema_leaves):
+    """Meta dict from the resolver -> (array_path, indices, field, label)."""
+    if not meta or _norm_section(meta.get("section")) != sect_norm:
+        return None
+    field = meta.get("schema_field")
+    if not field or field not in schema_leaves:
+        return None
+    array_path = tuple(sys.intern(a) for a in meta.get("array_path") or ())
+    indices = tuple(meta.get("indices") or ())
+    return (array_path, indices, sys.intern(field), meta.get("index_label"))
+
+
+# A level1 cell is a (fields, child_maps) pair: payload keys never mix
+# with child accumulators, so no sentinel keys and no startswith scans
+# at finalize time.
+def _get_cell(level1, arr1, idx1):
+    key = (arr1, idx1)
+    cell = level1.get(key)
+    if cell is None:
+        cell = ({}, {})
+        level1[key] = cell
+    return cell
+
+
+# Child instance numbers are small dense ints (drug episode 1..6), so the
+# accumulator is a 1-based list grown on demand: no hashing per insert and
+# no sort at finalize, just an enumerate over the slots.
+def _append_child(child_maps, arr2, idx2, field, val):
+    lst = child_maps.setdefault(arr2, [])
+    while len(lst) <= idx2:
+        lst.append(None)
+    ch = lst[idx2]
+    if ch is None:
+        ch = lst[idx2] = {}
+    ch[field] = val
+
+
+def _finalize_children(fields, child_maps, index_field_by_array, child_max):
+    for arr2, cmap in child_maps.items():
+        idx_field2 = index_field_by_array.get(arr2)
+        children = []
+        for idx2, ch in enumerate(cmap):
+            if ch is None:
+                continue
+            # cheap emptiness scan; no dict is built just to be discarded
+            has_payload = False
+            for kk, vv in ch.items():
+                if kk == idx_field2:
+                    continue
+                if vv is not None and vv != "" and vv != [] and vv != {}:
+                    has_payload = True
+                    break
+            if not has_payload:
+                continue
+            if idx_field2 and idx_field2 not in ch:
+                ch[idx_field2] = idx2
+            children.append(ch)
+        cap = child_max.get(arr2)
+        if cap is not None:
+            children = children[:cap]
+        if children:
+            fields[arr2] = children
+
+
+def _order_extras_last(item):
+    """Keep *Extra child arrays after the regular fields, schema-style."""
+    base = {}
+    extra = {}
+    for k, v in item.items():
+        (extra if isinstance(v, list) and k.endswith("Extra") else base)[k] = v
+    if extra:
+        base.update(extra)
+    return base
+
+
+def _restructure_record(rec, raw_class, toplevel_arrays, index_field_by_array,
+                        child_max, ignore_by_array):
+    """Build one nested object from one flat record (precomputed tables)."""
+    obj: Dict[str, Any] = {}
+    # Flat (array, index) -> cell map: one hash lookup per access
+    # instead of two chained dicts, and far fewer small dict objects.
+    level1: Dict[Tuple[str, int], Tuple[dict, dict]] = {}
+
+    raw_class_get = raw_class.get
+    for raw, val in rec.items():
+        if val in _EMPTY:
+            continue
+        cls = raw_class_get(raw)
+        if cls is None:
+            continue
+        depth, field, arr1, idx1, arr2, idx2 = cls
+        if depth == 0:
+            obj[field] = val
+        elif depth == 1:
+            fields, _ = _get_cell(level1, arr1, idx1)
+            fields[field] = val
+        else:
+            _, child_maps = _get_cell(level1, arr1, idx1)
+            _append_child(child_maps, arr2, idx2, field, val)
+
+    _finalize_record(obj, level1, toplevel_arrays, index_field_by_array,
+                     child_max, ignore_by_array)
+    return obj
+
+
+def _finalize_record(obj, level1, toplevel_arrays, index_field_by_array,
+                     child_max, ignore_by_array):
+    """Collapse the accumulated level1 cells into the nested arrays of obj."""
+    by_array: Dict[str, list] = {}
+    for (arr1, idx1), cell in level1.items():
+        by_array.setdefault(arr1, []).append((idx1, cell))
+
+    for arr1 in toplevel_arrays:
+        entries = by_array.get(arr1)
+        if not entries:
+            continue
+        entries.sort()
+        idx_field1 = index_field_by_array.get(arr1)
+        ignore = ignore_by_array[arr1]
+        items = []
+        for idx1, (fields, child_maps) in entries:
+            _finalize_children(fields, child_maps, index_field_by_array, child_max)
+            # every write into a cell was already filtered against _EMPTY
+            # and child arrays are only attached when non-empty, so the
+            # payload test is a flat key scan, not a nested walk
+            if not any(k not in ignore for k in fields):
+                continue
+            if idx_field1 and idx_field1 not in fields:
+                fields[idx_field1] = idx1
+            items.append(_order_extras_last(fields))
+        if items:
+            obj[arr1] = items
+
+    return obj
+
+
+# Worker-process state for the parallel path: the precomputed tables are
+# pickled once via the pool initializer instead of once per chunk.
+_POOL_STATE: Optional[tuple] = None
+
+
+def _pool_init(state):
+    global _POOL_STATE
+    _POOL_STATE = state
+
+
+def _restructure_chunk(chunk):
+    state = _POOL_STATE
+    return [_restructure_record(rec, *state) for rec in chunk]
+
+
+def restructure_by_schema(processed_data: List[dict], schema: dict, section_slug: str,
+                          variable_mapping: Optional[Dict[str, str]] = None,
+                          accept_prefixes: Optional[Tuple[str, ...]] = None,
+                          workers: int = 1,
+                          schema_path: Optional[str] = None) -> List[dict]:
+    """
+    Restructure flat processed records into the nested shape described by
+    the section schema.
+
+    Parameters:
+        processed_data (list[dict]): flat records (column -> value)
+        schema (dict): raw section schema (top-level properties)
+        section_slug (string): section label, e.g. "Pregnancies"
+        variable_mapping (dict): optional raw -> schema-leaf overrides
+        accept_prefixes (tuple): optional column-name prefixes belonging
+            to this section; anything else skips the resolver entirely
+        workers (int): processes to restructure records in parallel;
+            records are independent once the tables are precomputed
+        schema_path (string): optional path of the schema file, enabling
+            the cross-process schema-facts disk cache
+
+    Returns:
+        list[dict]: one nested object per input record
+    """
+    state = _restructure_state(processed_data, schema, section_slug,
+                               variable_mapping, accept_prefixes, schema_path)
+
+    if workers > 1 and len(processed_data) > workers:
+        from concurrent.futures import ProcessPoolExecutor
+
+        step = max(64, -(-len(processed_data) // (workers * 4)))
+        chunks = [processed_data[i:i + step] for i in range(0, len(processed_data), step)]
+        out: List[dict] = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_pool_init,
+                                 initargs=(state,)) as executor:
+            for part in executor.map(_restructure_chunk, chunks):
+                out.extend(part)
+        return out
+
+    return list(iter_restructure_by_schema(processed_data, schema, section_slug,
+                                           variable_mapping, accept_prefixes,
+                                           _state=state))
+
+
+def iter_restructure_by_schema(processed_data: List[dict], schema: dict, section_slug: str,
+                               variable_mapping: Optional[Dict[str, str]] = None,
+                               accept_prefixes: Optional[Tuple[str, ...]] = None,
+                               _state: Optional[tuple] = None):
+    """
+    Generator form of restructure_by_schema: yields one nested object per
+    record so callers that stream-write output never hold both the flat
+    input and the whole restructured batch in memory at once.
+    """
+    if _state is None:
+        _state = _restructure_state(processed_data, schema, section_slug,
+                                    variable_mapping, accept_prefixes)
+    for rec in processed_data:
+        yield _restructure_record(rec, *_state)
+
+
+def _restructure_state(processed_data, schema, section_slug, variable_mapping,
+                       accept_prefixes, schema_path=None):
+    """Precompute the per-batch classification tables (one pass, no records)."""
+    variable_mapping = variable_mapping or {}
+
+    facts = _schema_facts(schema, schema_path)
+    leaf_index = facts.leaf_index
+    schema_leaves = facts.schema_leaves
+    toplevel_arrays = facts.toplevel_arrays
+    index_field_by_array = facts.index_field_by_array
+    child_max = facts.child_max
+    toplevel_leaves = facts.toplevel_leaves
+    leaf_to_arr1 = facts.leaf_to_arr1
+
+    sect_norm = _norm_section(section_slug)
+
+    # Warm the section resolver cache so validation has a fresh index of
+    # every column seen in this batch.
+    all_keys = set().union(*(rec.keys() for rec in processed_data))
+    all_keys.discard("R0_StudyID")
+    unresolved = all_keys - schema_leaves - variable_mapping.keys()
+    if unresolved:
+        try:
+            nv.build_resolver_cache_from_columns(unresolved, section_slug)
+        except Exception:
+            pass
+
+    # Pre-resolve every raw key once into immutable tuples; the same few
+    # hundred names repeat across thousands of records, so the per-record
+    # loop pays a single dict lookup per key. variable_mapping overrides
+    # are folded into the same table. Re-runs over the same inputs (one
+    # process per section is the normal invocation) warm-start the whole
+    # table from a pickle; the key covers everything the resolved table
+    # depends on — the schema's leaf placements, the mapping overrides
+    # and the accept prefixes as well as the column set — so an edited
+    # schema or a different mapping never reuses stale placements.
+    fingerprint = repr((sorted(all_keys),
+                        sorted(leaf_index.items()),
+                        sorted(variable_mapping.items()),
+                        accept_prefixes,
+                        sect_norm))
+    col_hash = hashlib.blake2b(fingerprint.encode(), digest_size=16).hexdigest()
+    cached_meta = _load_resolved_meta_cache(section_slug, col_hash)
+    resolved_meta: Dict[str, Optional[tuple]] = cached_meta if cached_meta is not None else {}
+    for raw in () if cached_meta is not None else all_keys:
+        if raw in schema_leaves:
+            continue
+        if raw in _SKIP_RAWS:
+            resolved_meta[raw] = None
+            continue
+        if accept_prefixes is not None and not raw.startswith(accept_prefixes):
+            resolved_meta[raw] = None
+            continue
+        mapped = variable_mapping.get(raw)
+        if mapped is not None and mapped in schema_leaves:
+            resolved_meta[raw] = (leaf_index.get(mapped, ()), (), sys.intern(mapped), None)
+            continue
+        resolved_meta[raw] = _resolve_tuple(raw, sect_norm, schema_leaves)
+    if cached_meta is None:
+        _store_resolved_meta_cache(section_slug, col_hash, resolved_meta)
+
+    # Partition every key once into a flat classification table so the
+    # per-record loop is a single dict.get plus a small depth switch,
+    # instead of three membership tests per key per record.
+    raw_class: Dict[str, Optional[tuple]] = {}
+    for raw in all_keys:
+        if raw in toplevel_leaves:
+            raw_class[raw] = (0, raw, None, 1, None, 1)
+            continue
+        arr1 = leaf_to_arr1.get(raw)
+        if arr1 is not None:
+            raw_class[raw] = (1, raw, arr1, 1, None, 1)
+            continue
+        if raw in schema_leaves:
+            # depth-2 schema leaf named directly (no instance suffix):
+            # encode its placement so the record loop needs no fallback
+            ap = leaf_index.get(raw, ())
+            raw_class[raw] = (2, raw, ap[0], 1, ap[1], 1) if len(ap) > 1 else None
+            continue
+        meta = resolved_meta.get(raw)
+        if meta is None:
+            raw_class[raw] = None
+            continue
+        ap, idxs, field, index_label = meta
+        if not ap:
+            raw_class[raw] = (0, field, None, 1, None, 1)
+        elif len(ap) == 1:
+            raw_class[raw] = (1, field, ap[0], idxs[0] if idxs else 1, None, 1)
+        else:
+            raw_class[raw] = (
+                2, field, ap[0], idxs[0] if idxs else 1,
+                ap[1], idxs[1] if len(idxs) > 1 else 1,
+            )
+
+    # The identifier is a plain schema leaf (classified above under its
+    # schema name); records from older flat feeds that still carry it as
+    # R0_StudyID deliver it under the schema's declared primary key
+    primary_key = sys.intern(schema.get("x-primaryKey") or "StudyID")
+    raw_class["R0_StudyID"] = (0, primary_key, None, 1, None, 1)
+
+    # One frozenset per array instead of a fresh set per item per record
+    ignore_by_array = {
+        arr: frozenset((index_field_by_array[arr],)) if arr in index_field_by_array else frozenset()
+        for arr in toplevel_arrays
+    }
+
+    return (raw_class, toplevel_arrays, index_field_by_array, child_max, ignore_by_array)
+
+
+def compile_restructurer(schema: dict, section_slug: str, columns,
+                         variable_mapping: Optional[Dict[str, str]] = None,
+                         accept_prefixes: Optional[Tuple[str, ...]] = None):
+    """
+    Specialise restructuring for one section and one flat column set.
+
+    All schema interpretation (leaf placement, array paths, instance
+    indices) is folded into the classification tables up front, so the
+    returned callable does no schema work per record — just the depth
+    switch over precomputed tuples.
+
+    Parameters:
+        schema (dict): raw section schema
+        section_slug (string): section label, e.g. "Pregnancies"
+        columns: the flat column names the records will carry
+        variable_mapping (dict): optional raw -> schema-leaf overrides
+        accept_prefixes (tuple): optional section column-name prefixes
+
+    Returns:
+        callable: flat record (dict) -> nested object (dict)
+    """
+    state = _restructure_state([dict.fromkeys(columns)], schema, section_slug,
+                               variable_mapping, accept_prefixes)
+
+    def _restructure(rec, _state=state):
+        return _restructure_record(rec, *_state)
+
+    return _restructure
+
+
+def restructure_all(processed_data: List[dict], schema_by_section: Dict[str, dict],
+                    variable_mapping: Optional[Dict[str, str]] = None) -> Dict[str, List[dict]]:
+    """
+    Restructure one flat batch into every section's nested shape in a
+    single pass over the records.
+
+    Calling the 19 per-section builders sequentially walks processed_data
+    19 times; here each section's classification table is built once,
+    merged into one raw-key dispatch, and every record is traversed
+    exactly once with its keys routed to per-section accumulators.
+
+    Parameters:
+        processed_data (list[dict]): flat records (column -> value)
+        schema_by_section (dict): section slug -> raw section schema
+        variable_mapping (dict): optional raw -> schema-leaf overrides
+
+    Returns:
+        dict: section slug -> list of nested objects, one per record
+    """
+    states: Dict[str, tuple] = {}
+    dispatch: Dict[str, list] = {}
+    for sect, schema in schema_by_section.items():
+        state = _restructure_state(processed_data, schema, sect, variable_mapping, None)
+        states[sect] = state
+        for raw, cls in state[0].items():
+            if cls is not None:
+                dispatch.setdefault(raw, []).append((sect, cls))
+
+    out: Dict[str, List[dict]] = {sect: [] for sect in schema_by_section}
+    dispatch_get = dispatch.get
+
+    for rec in processed_data:
+        accs: Dict[str, Tuple[dict, dict]] = {sect: ({}, {}) for sect in states}
+
+        for raw, val in rec.items():
+            if val in _EMPTY:
+                continue
+            routes = dispatch_get(raw)
+            if routes is None:
+                continue
+            for sect, cls in routes:
+                obj, level1 = accs[sect]
+                depth, field, arr1, idx1, arr2, idx2 = cls
+                if depth == 0:
+                    obj[field] = val
+                elif depth == 1:
+                    fields, _ = _get_cell(level1, arr1, idx1)
+                    fields[field] = val
+                else:
+                    _, child_maps = _get_cell(level1, arr1, idx1)
+                    _append_child(child_maps, arr2, idx2, field, val)
+
+        for sect, (obj, level1) in accs.items():
+            _, toplevel_arrays, index_field_by_array, child_max, ignore_by_array = states[sect]
+            _finalize_record(obj, level1, toplevel_arrays, index_field_by_array,
+                             child_max, ignore_by_array)
+            out[sect].append(obj)
+
+    return out
+
+
+# ------------------------------------------------------------
+# Section wrappers
+# ------------------------------------------------------------
+
+def restructure_alcohol_smoking_diet(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "AlcoholSmokingDiet", variable_mapping)
+
+
+def restructure_birth_details(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "BirthDetails", variable_mapping)
+
+
+def restructure_breast_cancer(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "BreastCancer", variable_mapping)
+
+
+def restructure_breast_disease(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "BreastDisease", variable_mapping)
+
+
+def restructure_cancer_relatives(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "CancerRelatives", variable_mapping)
+
+
+def restructure_contraceptive_hrt(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "ContraceptiveHRT", variable_mapping)
+
+
+def restructure_general_information(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "GeneralInformation", variable_mapping)
+
+
+def restructure_jobs(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "Jobs", variable_mapping)
+
+
+def restructure_mammograms(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "Mammograms", variable_mapping)
+
+
+def restructure_menstrual_menopause(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "MenstrualMenopause", variable_mapping)
+
+
+def restructure_mh_cancers_benign_tumors(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "MH_CancersBenignTumors", variable_mapping)
+
+
+def restructure_mh_drugs_supplements(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "MH_DrugsSupplements", variable_mapping)
+
+
+def restructure_mh_illnesses(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "MH_Illnesses", variable_mapping)
+
+
+def restructure_other_breast_surgery(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "OtherBreastSurgery", variable_mapping)
+
+
+def restructure_other_lifestyle_factors(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "OtherLifestyleFactors", variable_mapping)
+
+
+def restructure_physical_activity(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "PhysicalActivity", variable_mapping)
+
+
+def restructure_physical_development(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "PhysicalDevelopment", variable_mapping)
+
+
+def restructure_pregnancies(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "Pregnancies", variable_mapping)
+
+
+def restructure_xrays(processed_data, schema, variable_mapping=None):
+    return restructure_by_schema(processed_data, schema, "XRays", variable_mapping)
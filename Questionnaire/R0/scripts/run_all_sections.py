@@ -0,0 +1,223 @@
+# run_all_sections.py
+#
+# Drives the R0 questionnaire ETL end to end for every section: load and
+# pivot the long-form responses, clean per the section schema,
+# restructure into the nested shape, validate against the raw and
+# pseudo-anon schemas and write the outputs.
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+_CFG_PATH = os.path.abspath(
+    "N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"
+)
+if _CFG_PATH not in sys.path:
+    sys.path.insert(0, _CFG_PATH)
+
+import config as cf
+from utilities import createLogger
+from common_utils import (SchemaIndex, load_schema, validate_records,
+                          process_data, load_and_pivot_data, mask_pii, save_output)
+import nested_utils as nv
+import restructure_utils as ru
+from pseudo_anon_utils import load_sid_codes
+
+
+SECTION_ORDER = [
+    'GeneralInformation',
+    'PhysicalDevelopment',
+    'MenstrualMenopause',
+    'ContraceptiveHRT',
+    'Pregnancies',
+    'BirthDetails',
+    'AlcoholSmokingDiet',
+    'PhysicalActivity',
+    'Jobs',
+    'OtherLifestyleFactors',
+    'Mammograms',
+    'XRays',
+    'BreastDisease',
+    'OtherBreastSurgery',
+    'BreastCancer',
+    'MH_Illnesses',
+    'MH_DrugsSupplements',
+    'MH_CancersBenignTumors',
+    'CancerRelatives',
+]
+
+# QuestionID ranges per section in the R0 questionnaire
+SECTION_QUESTION_RANGES = {
+    'GeneralInformation': (1, 60),
+    'PhysicalDevelopment': (61, 170),
+    'MenstrualMenopause': (171, 260),
+    'ContraceptiveHRT': (261, 420),
+    'Pregnancies': (421, 740),
+    'BirthDetails': (741, 800),
+    'AlcoholSmokingDiet': (801, 960),
+    'PhysicalActivity': (961, 1100),
+    'Jobs': (1101, 1260),
+    'OtherLifestyleFactors': (1261, 1340),
+    'Mammograms': (1341, 1420),
+    'XRays': (1421, 1540),
+    'BreastDisease': (1541, 1660),
+    'OtherBreastSurgery': (1661, 1720),
+    'BreastCancer': (1721, 2060),
+    'MH_Illnesses': (2061, 2260),
+    'MH_DrugsSupplements': (2261, 2420),
+    'MH_CancersBenignTumors': (2421, 2520),
+    'CancerRelatives': (2521, 2700),
+}
+
+
+# StudyID -> TCode from SIDCodes, loaded once per process and shared by
+# every section the worker runs
+_TCODE_MAP = None
+
+
+def _tcode_map(logger):
+    global _TCODE_MAP
+    if _TCODE_MAP is None:
+        sid_df = load_sid_codes(cf.live_server, logger)
+        _TCODE_MAP = sid_df.set_index('StudyID')['TCode'].to_dict()
+    return _TCODE_MAP
+
+
+def _pseudo_anonymize(masked, primary_key, logger):
+    '''
+    Re-keys the masked records under their TCode pseudonym: the
+    pseudo-anon schemas require TCode, carry no StudyID property and
+    forbid unknown properties, so the study identifier must be swapped
+    via SIDCodes before the pseudo-anon validation (as the pathology
+    pseudo-anon pipeline does)
+
+    Parameters:
+        masked (dict): StudyID -> masked record
+        primary_key (string): the raw schema's identifier field name
+        logger (logging): logger object to log the statements
+
+    Returns:
+        out (dict): TCode -> record carrying TCode instead of StudyID
+    '''
+    tcode_map = _tcode_map(logger)
+    out = {}
+    for study_id, record in masked.items():
+        record.pop(primary_key, None)
+        tcode = tcode_map.get(int(study_id))
+        if tcode is None:
+            logger.error(f'No TCode in SIDCodes for StudyID {study_id}')
+        rec = {'TCode': tcode}
+        rec.update(record)
+        out[str(tcode)] = rec
+    return out
+
+
+def _pii_schema_leaves(raw_names, variable_mapping):
+    '''
+    Maps flagged raw variable names onto the schema leaves the
+    restructured records actually carry: restructuring strips the
+    instance suffixes (raw R0_Preg_EndDay_4 lives as R0_Preg_EndDay
+    inside the array), so a flagged raw name can never match directly
+
+    Parameters:
+        raw_names (iterable): VariableName values flagged as PII
+        variable_mapping (dict): raw -> schema field overrides
+
+    Returns:
+        leaves (frozenset): schema leaf names to mask
+    '''
+    leaves = set()
+    for raw in raw_names:
+        mapped = variable_mapping.get(raw)
+        if mapped is None:
+            try:
+                mapped = nv.rename_variable(raw)['schema_field']
+            except KeyError:
+                mapped = raw
+        leaves.add(mapped)
+    return frozenset(leaves)
+
+
+def run_section(q_sect):
+    '''
+    Runs the full ETL for one questionnaire section
+
+    Parameters:
+        q_sect (string): section name from SECTION_ORDER
+
+    Returns:
+        q_sect (string): the section name, for completion bookkeeping
+    '''
+    logger = createLogger(q_sect, cf.Delivery_log_path)
+    logger.info(f'Processing section {q_sect}')
+
+    schema_path = os.path.join(cf.r0_json_path, f'{q_sect}_Schema.json')
+    schema = load_schema(schema_path)
+    pii_schema = load_schema(os.path.join(cf.r0_json_path_pii,
+                                          f'{q_sect}_Schema_PseudoAnon.json'))
+
+    # pivoted comes back StudyID-indexed with empty strings filled in;
+    # no reset_index/fillna copies needed, the column index is the raw
+    # column set
+    pivoted, dfPII = load_and_pivot_data(q_sect, SECTION_QUESTION_RANGES[q_sect], logger)
+    raw_columns = pivoted.columns
+
+    # restructure_by_schema persists the section resolver index itself
+    # while pre-resolving the columns, and validation reads that same
+    # file — only BreastCancer needs its specialised two-level builder
+    if q_sect == 'BreastCancer':
+        nv.build_breast_cancer_resolver_cache(raw_columns)
+
+    raw_data = pivoted
+    idx = SchemaIndex.for_schema(schema)
+    processed, change_tracking = process_data(raw_data, idx.constraint_map,
+                                              idx.variable_mapping)
+
+    # key each record under the schema's declared identifier: the raw
+    # schemas require StudyID and forbid unknown properties, so any
+    # other key fails validation twice per record
+    primary_key = schema.get('x-primaryKey', 'StudyID')
+    records = []
+    for study_id, responses in processed.items():
+        rec = {primary_key: study_id}
+        rec.update(responses)
+        records.append(rec)
+
+    # the schema path switches on the cross-process facts disk cache:
+    # each section runs in its own pool worker, so the in-memory facts
+    # cache starts cold every time
+    restructured = ru.restructure_by_schema(records, schema, q_sect,
+                                            idx.variable_mapping,
+                                            schema_path=schema_path)
+    data = {str(rec.get(primary_key)): rec for rec in restructured}
+
+    validate_records(data, schema, logger)
+    save_output(data, cf.out_json_path, f'{q_sect}_allvar.json')
+
+    pii_vars = _pii_schema_leaves(dfPII.loc[dfPII['PII'] == 1, 'VariableName'],
+                                  idx.variable_mapping)
+    masked = mask_pii(data, pii_vars, idx.nested_array_keys)
+    masked = _pseudo_anonymize(masked, primary_key, logger)
+    validate_records(masked, pii_schema, logger)
+    save_output(masked, cf.out_json_path, f'{q_sect}_piimask.json')
+
+    save_output(change_tracking, cf.ct_path, f'{q_sect}_change_tracking.json')
+
+    logger.info(f'Finished section {q_sect}')
+    return q_sect
+
+
+if __name__ == '__main__':
+    # sections are independent, so run them in a process pool: SQL
+    # round-trips, pivoting and disk writes for different sections
+    # overlap instead of summing
+    with ProcessPoolExecutor(max_workers=min(8, len(SECTION_ORDER))) as executor:
+        futures = {executor.submit(run_section, q_sect): q_sect
+                   for q_sect in SECTION_ORDER}
+        for future in as_completed(futures):
+            q_sect = futures[future]
+            try:
+                future.result()
+                print(f'{q_sect} completed')
+            except Exception as e:
+                print(f'{q_sect} failed: {e}')
@@ -0,0 +1,445 @@
+# validation_utils.py
+#
+# Value-frequency reconciliation between the raw pivoted questionnaire data
+# and the restructured (processed) JSON output. For every processed R0 leaf
+# the raw source columns are looked up through the section resolver index,
+# their value frequencies are summed, expected changes from change tracking
+# are applied, and the result is compared against the frequencies observed
+# in the processed JSON. The summary is written next to the other
+# ValidationSummary artefacts (variable_check.json, resolver indices).
+
+import os
+import sys
+import json
+import logging
+import pickle
+from functools import lru_cache
+from typing import Any, Dict, List
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+sys.path.append(os.path.abspath(
+    "N:\\CancerEpidem\\BrBreakthrough\\DeliveryProcess\\Schema_and_Derivation_utils"
+))
+
+logger = logging.getLogger("reconcile")
+
+
+# ------------------------------------------------------------
+# Canonicalisation helpers
+# ------------------------------------------------------------
+
+def _canon(v):
+    """Fold the different null flavours to None and everything else to str."""
+    if v is None:
+        return None
+    if isinstance(v, float) and pd.isna(v):
+        return None
+    if v is pd.NA or v is pd.NaT:
+        return None
+    s = str(v).strip()
+    return s if s else None
+
+
+def _value_counts_canon_list(values: list) -> Dict[str, int]:
+    """Canonicalised value counts of a plain list, nulls excluded."""
+    counts: Dict[str, int] = {}
+    get = counts.get
+    for v in values:
+        c = _canon(v)
+        if c is not None:
+            counts[c] = get(c, 0) + 1
+    return counts
+
+
+def _value_counts_canon_column(series: pd.Series) -> Dict[str, int]:
+    """
+    Canonicalised value counts computed with vectorised pandas string ops.
+    Equivalent to _value_counts_canon_list for columns of scalars, but
+    counts in C instead of a per-cell Python loop.
+    """
+    s = series.dropna().astype(str).str.strip()
+    s = s[s != ""]
+    return s.value_counts().to_dict()
+
+
+# ------------------------------------------------------------
+# Resolver / processed JSON helpers
+# ------------------------------------------------------------
+
+def _resolver_pairs_instance_expanded(resolver_index: dict) -> Dict[str, List[str]]:
+    """
+    Flatten the resolver index into {processed_leaf: [raw_columns]}.
+
+    The resolver index stores per-leaf buckets keyed by instance label plus
+    an 'all' bucket; only the 'all' bucket is needed for reconciliation.
+    """
+    pairs: Dict[str, List[str]] = {}
+    for proc, mapping in resolver_index.items():
+        if isinstance(mapping, dict):
+            pairs[proc] = list(mapping.get("all", []))
+        elif isinstance(mapping, list):
+            pairs[proc] = list(mapping)
+    return pairs
+
+
+def _resolver_pairs_cached(resolver_path: str) -> Dict[str, List[str]]:
+    """
+    Flattened resolver pairs backed by a sidecar pickle. Unpickling the
+    pre-flattened mapping is much cheaper than parsing the resolver JSON
+    and expanding the instance buckets; the sidecar is rebuilt whenever
+    it is older than the resolver index it was derived from.
+    """
+    pkl_path = resolver_path + ".pairs.pkl"
+    src_mtime = os.path.getmtime(resolver_path)
+    try:
+        if os.path.getmtime(pkl_path) >= src_mtime:
+            with open(pkl_path, "rb") as f:
+                return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    pairs = _resolver_pairs_instance_expanded(_load_if_path(resolver_path))
+    try:
+        with open(pkl_path, "wb") as f:
+            pickle.dump(pairs, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # read-only location: fall back to recomputing each run
+    return pairs
+
+
+def _collect_values_for_processed_leaf(processed_json, leaf: str) -> list:
+    """Collect every value stored under key `leaf` anywhere in the output."""
+    return _collect_values_by_leaf(processed_json, frozenset((leaf,))).get(leaf, [])
+
+
+def _collect_values_by_leaf(processed_json, leaves) -> Dict[str, list]:
+    """
+    Collect the values of every wanted leaf in a single walk of the
+    processed output, instead of one full traversal per leaf.
+    """
+    found: Dict[str, list] = {leaf: [] for leaf in leaves}
+
+    def walk(node):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if k in found and not isinstance(v, (dict, list)):
+                    found[k].append(v)
+                else:
+                    walk(v)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(processed_json)
+    return found
+
+
+def _resolve_chain_map(ct_map: dict) -> dict:
+    """
+    Pre-resolve a change-tracking map to {src: terminal_value} so applying
+    it is a single dict lookup per value.
+    """
+    resolved = {}
+    for src in ct_map:
+        dst = src
+        seen = set()
+        while dst in ct_map and dst not in seen:
+            seen.add(dst)
+            entry = ct_map[dst]
+            dst = entry.get("new_value") if isinstance(entry, dict) else entry
+        resolved[src] = _canon(dst)
+    return resolved
+
+
+def _apply_change_chain_bulk(per_raw_original: Dict[str, Dict[str, int]], resolved_ct: dict) -> Dict[str, int]:
+    """
+    Accumulate the expected post-cleaning frequencies for a leaf in one
+    pass. `resolved_ct` holds the flat src->terminal maps produced by
+    _resolve_chain_map once per raw column, before the leaf loop, so no
+    chain walking happens here.
+    """
+    expected: Dict[str, int] = {}
+    get = expected.get
+    for raw_name, orig in per_raw_original.items():
+        resolved = resolved_ct.get(raw_name)
+        if resolved:
+            for key, n in orig.items():
+                dst = resolved.get(key, key)
+                if dst is not None:
+                    expected[dst] = get(dst, 0) + n
+        else:
+            for key, n in orig.items():
+                expected[key] = get(key, 0) + n
+    return expected
+
+
+@lru_cache(maxsize=64)
+def _load_json_cached(path: str, mtime: float):
+    """
+    Parse a JSON artefact, cached on (path, mtime). The resolver index and
+    variable_check files are reloaded for every section run; keying on the
+    modification time keeps re-runs free while still picking up edits.
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_if_path(obj):
+    """Accept either an already-parsed dict or a path to a JSON file."""
+    if isinstance(obj, (str, os.PathLike)):
+        path = os.fspath(obj)
+        return _load_json_cached(path, os.path.getmtime(path))
+    return obj
+
+
+def _reconcile_one_leaf(task) -> tuple:
+    """
+    Reconcile one processed leaf. Module-level so it can be shipped to a
+    worker process; takes only the small precomputed inputs for its leaf.
+    """
+    r0_leaf, per_raw_original, ct_subset, actual_vals = task
+
+    # Expected frequencies after cleaning (apply change-tracking chains).
+    # Most leaves map to a single raw column with no tracked changes, in
+    # which case the raw counts already are the expected counts.
+    if not ct_subset and len(per_raw_original) == 1:
+        sum_expected = next(iter(per_raw_original.values()))
+    else:
+        sum_expected = _apply_change_chain_bulk(per_raw_original, ct_subset)
+
+    # Actual frequencies observed in the processed output (pre-counted
+    # when the leaf could be read straight off the columnar frame)
+    if isinstance(actual_vals, dict):
+        actual_counts = actual_vals
+    else:
+        actual_counts = _value_counts_canon_list(actual_vals)
+
+    expected = {k: int(v) for k, v in sum_expected.items() if v}
+    actual = {k: int(v) for k, v in actual_counts.items() if v}
+
+    # The vast majority of leaves match perfectly; detect that with a
+    # single dict comparison before doing any per-key work.
+    if expected == actual:
+        discrepancies = {}
+    else:
+        diff_keys = (expected.keys() ^ actual.keys()) | {
+            k for k in expected.keys() & actual.keys() if expected[k] != actual[k]
+        }
+        discrepancies = {
+            str(k): {"expected": expected.get(k, 0), "actual": actual.get(k, 0)}
+            for k in diff_keys
+        }
+    is_perfect = not discrepancies
+
+    payload = {
+        "raw_columns": sorted(per_raw_original.keys()),
+        "expected_total": sum(expected.values()),
+        "actual_total": sum(actual.values()),
+        "perfect_match": is_perfect,
+        "discrepancies": discrepancies,
+    }
+    return r0_leaf, payload, is_perfect
+
+
+# ------------------------------------------------------------
+# Main reconciliation
+# ------------------------------------------------------------
+
+def reconcile_value_frequencies(
+    raw_pivot_df: pd.DataFrame,
+    processed_json,
+    resolver_index,
+    stage_name: str,
+    variable_check=None,
+    change_tracking=None,
+    out_path: str | None = None,
+    verbose: bool = False,
+    workers: int = 1,
+) -> dict:
+    """
+    Compare value frequencies of raw columns against processed leaves.
+
+    Parameters:
+        raw_pivot_df (pd.DataFrame): pivoted raw section data (StudyID x raw column)
+        processed_json: restructured section output (list/dict of records)
+        resolver_index: resolver index dict or path to <section>_resolver_index.json
+        stage_name (string): section label used as the top-level key in the report
+        variable_check: variable_check dict or path; supplies PII/date raw columns
+        change_tracking: change-tracking dict or path ({raw: {value: new_value}})
+        out_path (string): where to write the reconciliation JSON (optional)
+        verbose (bool): emit per-leaf diagnostics on the 'reconcile' logger
+        workers (int): reconcile leaves across this many processes (1 = serial)
+
+    Returns:
+        dict: {stage_name: stage summary}
+    """
+    variable_check = _load_if_path(variable_check) or {}
+    change_tracking = _load_if_path(change_tracking) or {}
+
+    if isinstance(resolver_index, (str, os.PathLike)):
+        pairs = _resolver_pairs_cached(os.fspath(resolver_index))
+    else:
+        pairs = _resolver_pairs_instance_expanded(resolver_index)
+    processed_leaves = set(pairs)
+
+    # Raw columns accounted for as PII or dates never appear in the processed
+    # output, so their processed counterparts must be skipped entirely.
+    details = variable_check.get("details", {})
+    accounted_pii_raw = frozenset(details.get("accounted_pii", []))
+    accounted_dates_raw = frozenset(details.get("accounted_dates", []))
+
+    # One-pass inversion of the resolver pairs (raw -> processed) and
+    # derivation of the skip sets. frozenset keeps the hot-loop membership
+    # checks on the C fast path.
+    pii_processed = set()
+    date_processed = set()
+    for proc, raws in pairs.items():
+        for raw in raws:
+            if raw in accounted_pii_raw:
+                pii_processed.add(proc)
+            elif raw in accounted_dates_raw:
+                date_processed.add(proc)
+
+    skip_proc = frozenset({"R0_StudyID", "R0_TCode"})
+    skip_raw = frozenset({"StudyID"})
+    skip_processed = frozenset(pii_processed | date_processed)
+
+    # Canonicalise each distinct raw column exactly once. The same raw
+    # column can feed many processed leaves, so counting per (leaf, raw)
+    # pair would rescan the pivot frame redundantly.
+    needed_raws = {
+        raw
+        for proc, raws in pairs.items()
+        if proc not in skip_proc
+        for raw in raws
+        if raw not in skip_raw
+    }
+    raw_counts_cache: Dict[str, Dict[str, int]] = {
+        raw: _value_counts_canon_column(raw_pivot_df[raw])
+        for raw in needed_raws
+        if raw in raw_pivot_df.columns
+    }
+
+    # Sets, not lists: later adjustments (adding or reclassifying leaves)
+    # stay O(1) instead of list scans, and order is imposed only once
+    # when the summary is built.
+    results: Dict[str, Any] = {}
+    mismatched: set = set()
+    perfect: set = set()
+
+    # Diagnostics go through logging so formatting is deferred until a
+    # handler actually fires; the isEnabledFor check is paid once, not
+    # per leaf.
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+        if not logger.handlers and not logging.getLogger().handlers:
+            logging.basicConfig(format="%(message)s")
+    _debug = logger.isEnabledFor(logging.DEBUG)
+
+    # Subtract the skip sets up front so skipped leaves are never sorted,
+    # counted or walked; only survivors pay for anything downstream.
+    if _debug:
+        for r0_leaf in sorted((processed_leaves - skip_proc) & skip_processed):
+            reason = "PII" if r0_leaf in pii_processed else "date-shifted"
+            logger.debug("SKIP %s (%s)", r0_leaf, reason)
+
+    candidates = sorted(processed_leaves - skip_proc - skip_processed)
+
+    # Flat records are tabular: hold them in columnar form once and count
+    # top-level leaves directly off the frame, bypassing the recursive
+    # walker for everything except nested array leaves.
+    precounted: Dict[str, Dict[str, int]] = {}
+    walk_leaves = set(candidates)
+    if isinstance(processed_json, list) and processed_json and all(
+        isinstance(r, dict) for r in processed_json
+    ):
+        processed_df = pd.DataFrame(processed_json)
+        for leaf in candidates:
+            if leaf not in processed_df.columns:
+                continue
+            col = processed_df[leaf]
+            if any(isinstance(v, (dict, list)) for v in col):
+                continue
+            precounted[leaf] = _value_counts_canon_column(col)
+            walk_leaves.discard(leaf)
+
+    # One walk of the processed output for the remaining leaves; each
+    # per-leaf task then carries only its own small inputs (cheap to ship
+    # to workers).
+    actual_by_leaf = _collect_values_by_leaf(processed_json, frozenset(walk_leaves))
+
+    # Flatten every change chain once, before the leaf loop; each leaf
+    # (and each worker) then only sees ready-made flat lookup maps.
+    resolved_ct = {
+        raw_name: _resolve_chain_map(ct_map)
+        for raw_name, ct_map in change_tracking.items()
+    }
+
+    tasks = []
+    for r0_leaf in candidates:
+        raw_names = [r for r in pairs.get(r0_leaf, []) if r not in skip_raw]
+        per_raw_original = {
+            raw_name: raw_counts_cache[raw_name]
+            for raw_name in raw_names
+            if raw_name in raw_counts_cache
+        }
+        ct_subset = {
+            raw_name: resolved_ct[raw_name]
+            for raw_name in per_raw_original
+            if raw_name in resolved_ct
+        }
+        actuals = precounted.get(r0_leaf)
+        if actuals is None:
+            actuals = actual_by_leaf.get(r0_leaf, [])
+        tasks.append((r0_leaf, per_raw_original, ct_subset, actuals))
+
+    if workers > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_reconcile_one_leaf, tasks, chunksize=chunksize))
+    else:
+        outcomes = [_reconcile_one_leaf(task) for task in tasks]
+
+    for r0_leaf, payload, is_perfect in outcomes:
+        results[r0_leaf] = payload
+        (perfect if is_perfect else mismatched).add(r0_leaf)
+
+        if _debug and not is_perfect:
+            preview = dict(list(payload["discrepancies"].items())[:5])
+            logger.debug("MISMATCH %s -> %s", r0_leaf, preview)
+
+    stage = {
+        "variables_checked": len(results),
+        "variables_with_perfect_match": len(perfect),
+        "variables_with_mismatches": len(mismatched),
+        "mismatched_variables": sorted(mismatched),
+        "perfect_match_variables": sorted(perfect),
+        "status": "PASSED" if not mismatched else "WARNING",
+        "reconciliation_details": results,
+    }
+
+    report = {stage_name: stage}
+
+    if out_path is not None:
+        # Serialise once and hand the whole payload to a single buffered
+        # write instead of json.dump's many small writes.
+        if orjson is not None:
+            with open(out_path, "wb") as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            payload = json.dumps(report, indent=2, ensure_ascii=False)
+            with open(out_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+                f.write(payload)
+
+    return report
@@ -0,0 +1,18 @@
+# cleaning_rules.py
+#
+# Value recoding maps applied while cleaning the pivoted questionnaire
+# responses. Keys are schema field names (or raw variable names for
+# columns that are renamed later); each maps an observed response value
+# to the value delivered downstream. Content agreed with data management.
+
+newValMap = {
+    'R0_EverSmoked': {'Yes': 'Y', 'No': 'N', 'yes': 'Y', 'no': 'N'},
+    'R0_AlcoholEver': {'Yes': 'Y', 'No': 'N', 'yes': 'Y', 'no': 'N'},
+    'R0_HRTEver': {'Yes': 'Y', 'No': 'N', 'Not sure': 'NK'},
+    'R0_OCEver': {'Yes': 'Y', 'No': 'N', 'Not sure': 'NK'},
+    'R0_Handedness': {'Left': 'L', 'Right': 'R', 'Either': 'E'},
+    'R0_PeriodsRegular': {'Regular': 'R', 'Irregular': 'I'},
+}
+
+# response strings treated as missing during cleaning
+nullList = ['', 'null', 'NULL', 'NA', 'N/A']
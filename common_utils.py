@@ -0,0 +1,606 @@
+# common_utils.py
+#
+# Shared helpers for the questionnaire ETL: schema loading and
+# validation, per-cell cleaning of the pivoted response data, PII
+# masking and output writing. Used by the per-section R0 driver
+# (run_all_sections.py) and the derivation notebooks.
+
+import os
+import json
+import hashlib
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+
+import pandas as pd
+from jsonschema import Draft7Validator, FormatChecker
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import config as cf
+import cleaning_rules as cr
+from utilities import connect_DB, read_data
+
+_log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _load_schema_cached(schema_path, mtime):
+    if orjson is not None:
+        with open(schema_path, 'rb') as f:
+            schema = orjson.loads(f.read())
+    else:
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            schema = json.load(f)
+
+    _log.debug('Loaded schema %s', os.path.basename(schema_path))
+    return schema
+
+
+def load_schema(schema_path):
+    '''
+    Loads a JSON schema from disk. Parsed schemas are cached per path
+    (keyed on mtime, so an edited file reloads); callers share the
+    returned object and must not mutate it
+
+    Parameters:
+        schema_path (string): full path of the schema file
+
+    Returns:
+        schema (dict): parsed schema
+    '''
+    schema_path = os.path.abspath(schema_path)
+    return _load_schema_cached(schema_path, os.path.getmtime(schema_path))
+
+
+# Compiled validators keyed by schema identity: jsonschema re-compiles
+# the schema on every validate() call, and each section validates twice
+# (raw + pii) against the same loaded schema object.
+_VALIDATORS = {}
+
+
+def _get_validator(schema):
+    validator = _VALIDATORS.get(id(schema))
+    if validator is None:
+        validator = Draft7Validator(schema, format_checker=FormatChecker())
+        _VALIDATORS[id(schema)] = validator
+    return validator
+
+
+# Code-generated fastjsonschema validators, same identity-keyed cache.
+# fastjsonschema emits a plain Python function per schema rather than
+# interpreting the schema tree per instance.
+_COMPILED = {}
+
+
+def _get_compiled(schema):
+    compiled = _COMPILED.get(id(schema))
+    if compiled is None:
+        compiled = fastjsonschema.compile(schema)
+        _COMPILED[id(schema)] = compiled
+    return compiled
+
+
+def validate_data(json_data, schema, logger=None, use_jsonschema=False):
+    '''
+    Validates the output data against a section schema
+
+    Parameters:
+        json_data (dict): data keyed by StudyID
+        schema (dict): schema to validate against
+        logger (logging): optional logger for validation errors
+        use_jsonschema (bool): force the jsonschema path, for regression
+            checks against the code-generated validator
+
+    Returns:
+        valid (bool): True when the data validates
+    '''
+    if fastjsonschema is not None and not use_jsonschema:
+        try:
+            _get_compiled(schema)(json_data)
+            _log.debug('Validation passed')
+            return True
+        except fastjsonschema.JsonSchemaException as e:
+            message = f'Validation failed: {e.message}'
+            if logger is not None:
+                logger.error(message)
+            return False
+
+    validator = _get_validator(schema)
+
+    valid = True
+    for error in validator.iter_errors(json_data):
+        valid = False
+        message = f'Validation failed: {error.message} at {list(error.absolute_path)}'
+        if logger is not None:
+            logger.error(message)
+
+    if valid:
+        _log.debug('Validation passed')
+    return valid
+
+
+def validate_records(json_data, schema, logger=None):
+    '''
+    Validates a StudyID-keyed output dict one record at a time against
+    the record subschema, so each record only traverses the property
+    subtree (not the outer dict wrapper) and validation stops at the
+    first error per record
+
+    Parameters:
+        json_data (dict): data keyed by StudyID
+        schema (dict): section schema; records validate against its
+            additionalProperties subschema when present
+        logger (logging): optional logger for validation errors
+
+    Returns:
+        valid (bool): True when every record validates
+    '''
+    record_schema = schema.get('additionalProperties') or schema
+
+    valid = True
+    if fastjsonschema is not None:
+        compiled = _get_compiled(record_schema)
+        for study_id, record in json_data.items():
+            try:
+                compiled(record)
+            except fastjsonschema.JsonSchemaException as e:
+                valid = False
+                if logger is not None:
+                    logger.error(f'Validation failed for {study_id}: {e.message}')
+    else:
+        validator = _get_validator(record_schema)
+        for study_id, record in json_data.items():
+            error = next(validator.iter_errors(record), None)
+            if error is not None:
+                valid = False
+                if logger is not None:
+                    logger.error(f'Validation failed for {study_id}: {error.message} '
+                                 f'at {list(error.absolute_path)}')
+
+    if valid:
+        _log.debug('Validation passed')
+    return valid
+
+
+@dataclass(frozen=True)
+class SchemaIndex:
+    '''
+    Everything the ETL needs from one section schema, extracted in a
+    single walk and memoised per schema object: the constraint, type
+    and variable-name maps used to have one traversal each, repeated
+    per phase.
+    '''
+    variable_mapping: dict
+    constraint_map: dict
+    var_type_map: dict
+    pii_fields: frozenset
+    nested_array_keys: tuple
+
+    @classmethod
+    def for_schema(cls, schema):
+        idx = _SCHEMA_INDEXES.get(id(schema))
+        if idx is None:
+            idx = _build_schema_index(cls, schema)
+            _SCHEMA_INDEXES[id(schema)] = idx
+        return idx
+
+
+_SCHEMA_INDEXES = {}
+
+
+def _minmax_from_props(props):
+    if 'anyOf' in props:
+        for subschema in props['anyOf']:
+            if 'minimum' in subschema or 'maximum' in subschema:
+                return subschema.get('minimum'), subschema.get('maximum')
+        return None, None
+    return props.get('minimum'), props.get('maximum')
+
+
+def walk_properties(schema_props):
+    '''
+    Single traversal over a properties map (including one level of array
+    items), yielding (field, min, max, json_type, props) per property.
+    Every extractor consumes this one walk rather than re-implementing
+    the anyOf/items descent.
+    '''
+    for field, props in (schema_props or {}).items():
+        min_val, max_val = _minmax_from_props(props)
+        field_type = props.get('type')
+        if isinstance(field_type, list):
+            field_type = field_type[0]
+        yield field, min_val, max_val, field_type, props
+        item_props = (props.get('items') or {}).get('properties') or {}
+        yield from walk_properties(item_props)
+
+
+def _build_schema_index(cls, schema):
+    variable_mapping = {}
+    constraint_map = {}
+    var_type_map = {}
+    pii_fields = set()
+    nested_array_keys = []
+
+    for field, props in (schema.get('properties') or {}).items():
+        field_type = props.get('type')
+        if field_type == 'array' or (isinstance(field_type, list) and 'array' in field_type):
+            nested_array_keys.append(field)
+
+    for field, min_val, max_val, field_type, props in walk_properties(schema.get('properties')):
+        x_name = props.get('x-name')
+        if x_name and x_name != field:
+            variable_mapping[x_name] = field
+        if min_val is not None or max_val is not None:
+            constraint_map[field] = {'min': min_val, 'max': max_val}
+        if field_type:
+            var_type_map[field] = field_type
+        if props.get('x-pii'):
+            pii_fields.add(field)
+
+    return cls(variable_mapping, constraint_map, var_type_map,
+               frozenset(pii_fields), tuple(nested_array_keys))
+
+
+def extract_schema_constraints(schema):
+    '''
+    Extracts the numeric min/max constraints from a section schema,
+    including one level of nested array items
+
+    Parameters:
+        schema (dict): raw section schema
+
+    Returns:
+        constraint_map (dict): field name -> {'min': ..., 'max': ...}
+    '''
+    return SchemaIndex.for_schema(schema).constraint_map
+
+
+# cr.newValMap flattened to (name, value) keys: one hash probe per
+# lookup instead of two nested membership tests plus two getitems.
+_FLAT_NEWVALMAP = {
+    (name, value): new_value
+    for name, mapping in cr.newValMap.items()
+    for value, new_value in mapping.items()
+}
+_MISSING = object()
+
+
+def get_newvalmap_value(field_name, var_name, value):
+    '''
+    Looks up the recode for a response value, by schema field name first
+    and by raw variable name as a fallback
+
+    Parameters:
+        field_name (string): schema field name
+        var_name (string): raw variable name
+        value: raw response value
+
+    Returns:
+        the recoded value, or None when no recode applies
+    '''
+    mapped = _FLAT_NEWVALMAP.get((field_name, value), _MISSING)
+    if mapped is _MISSING and var_name != field_name:
+        mapped = _FLAT_NEWVALMAP.get((var_name, value), _MISSING)
+    return None if mapped is _MISSING else mapped
+
+
+def clean_value(value, field_name, var_name, constraints):
+    '''
+    Cleans a single response value: recodes via the newValMap, nulls the
+    agreed missing strings and clips numerics to the schema range
+
+    Parameters:
+        value: raw response value
+        field_name (string): schema field name
+        var_name (string): raw variable name
+        constraints (dict): output of extract_schema_constraints
+
+    Returns:
+        the cleaned value (77777 for out-of-range numerics)
+    '''
+    mapped = get_newvalmap_value(field_name, var_name, value)
+    if mapped is not None:
+        return mapped
+
+    if value in cr.nullList:
+        return None
+
+    limits = constraints.get(field_name) or constraints.get(var_name)
+    if limits is not None:
+        try:
+            converted = float(value)
+        except (TypeError, ValueError):
+            return value
+        if converted in (77777, 88888, 99999):
+            return int(converted)
+        if (limits['min'] is not None and converted < limits['min']) or \
+           (limits['max'] is not None and converted > limits['max']):
+            return 77777
+        if converted == int(converted):
+            return int(converted)
+        return converted
+
+    return value
+
+
+def _process_frame(df, constraints, variable_mapping=None):
+    '''
+    Column-wise cleaning of the pivoted frame: each variable is recoded,
+    nulled and range-checked as one vectorised pass over the column
+    instead of a Python call per cell.
+    '''
+    change_tracking = {}
+    out = df.copy()
+
+    for var_name in df.columns:
+        field_name = var_name
+        if variable_mapping is not None:
+            field_name = variable_mapping.get(var_name, var_name)
+        orig = df[var_name]
+
+        s = orig
+        sub = cr.newValMap.get(field_name) or cr.newValMap.get(var_name)
+        if sub:
+            mapped = s.map(sub)
+            s = mapped.where(mapped.notna(), s)
+        s = s.where(~s.isin(cr.nullList), None)
+
+        limits = constraints.get(field_name) or constraints.get(var_name)
+        if limits is not None:
+            num = pd.to_numeric(s, errors='coerce')
+            special = num.isin([77777, 88888, 99999])
+            oor = pd.Series(False, index=num.index)
+            if limits['min'] is not None:
+                oor |= num < limits['min']
+            if limits['max'] is not None:
+                oor |= num > limits['max']
+            num = num.where(~(oor & ~special), 77777)
+            s = s.mask(num.notna(), num)
+            # clean_value delivers whole numerics as Python ints; match
+            # it so type: integer fields survive strict validation
+            whole = num.notna() & (num % 1 == 0)
+            if whole.any():
+                s = s.astype(object)
+                s[whole] = [int(v) for v in num[whole]]
+
+        changed = orig.astype(str) != s.astype(str)
+        if changed.any():
+            # one groupby over the changed cells replaces a dict
+            # increment per cell; materialised into the nested report
+            # shape in a single comprehension
+            grouped = (pd.DataFrame({'old': orig[changed], 'new': s[changed]})
+                       .groupby('old', sort=False)
+                       .agg(count=('new', 'size'), new_value=('new', 'first')))
+            change_tracking[var_name] = {
+                raw_val: {'count': int(row['count']), 'new_value': row['new_value']}
+                for raw_val, row in grouped.iterrows()
+            }
+        out[var_name] = s
+
+    processed = out.to_dict('index')
+    _log.debug('Processed %d participants', len(processed))
+    return processed, change_tracking
+
+
+def process_data(raw_data, constraints, variable_mapping=None):
+    '''
+    Cleans every response value in the pivoted data and tracks the
+    changes made per variable and raw value
+
+    Parameters:
+        raw_data (dict or pandas dataframe): StudyID -> {variable name
+            -> raw value}, or the pivoted StudyID-indexed frame (cleaned
+            column-wise, far faster for large sections)
+        constraints (dict): output of extract_schema_constraints
+        variable_mapping (dict): optional raw -> schema field overrides
+
+    Returns:
+        processed (dict): StudyID -> cleaned record
+        change_tracking (dict): variable -> raw value -> count/new value
+    '''
+    if isinstance(raw_data, pd.DataFrame):
+        return _process_frame(raw_data, constraints, variable_mapping)
+
+    change_tracking = defaultdict(lambda: defaultdict(lambda: {'count': 0, 'new_value': None}))
+    processed = {}
+
+    for study_id, responses in raw_data.items():
+        record = {}
+        for var_name, value in responses.items():
+            field_name = var_name
+            if variable_mapping is not None:
+                field_name = variable_mapping.get(var_name, var_name)
+            cleaned = clean_value(value, field_name, var_name, constraints)
+            # cheap identity-ish compare first: most values clean to
+            # themselves, so the string coercions only run on type changes
+            if value != cleaned and str(value) != str(cleaned):
+                tracked = change_tracking[var_name][value]
+                tracked['count'] += 1
+                tracked['new_value'] = cleaned
+            record[var_name] = cleaned
+        processed[study_id] = record
+
+    _log.debug('Processed %d participants', len(processed))
+    return processed, change_tracking
+
+
+# One engine and one copy of the question metadata per process: with
+# sections spread over a pool, each worker connects once and filters the
+# small tables in pandas instead of issuing fresh round-trips per section.
+_DB_CONN = None
+
+
+def _get_connection(logger):
+    global _DB_CONN
+    if _DB_CONN is None:
+        _DB_CONN = connect_DB('Questionnaire', cf.live_server, logger)
+    return _DB_CONN
+
+
+_QUESTION_META = None
+
+
+def _question_metadata(logger):
+    global _QUESTION_META
+    if _QUESTION_META is None:
+        conn = _get_connection(logger)
+        dfQuest = read_data(
+            'SELECT QuestionID, VariableName, Section, QuestionTypeID FROM Questions',
+            conn, logger)
+        dfFlag = read_data(
+            'SELECT QuestionID, VariableName, PII FROM VariableFlagging',
+            conn, logger)
+        _QUESTION_META = (dfQuest, dfFlag)
+    return _QUESTION_META
+
+
+def load_and_pivot_data(q_sect, question_range, logger):
+    '''
+    Reads the long-form responses for one section and pivots them to one
+    row per participant
+
+    Parameters:
+        q_sect (string): section name, e.g. "Pregnancies"
+        question_range (tuple): (low, high) QuestionID range of the section
+        logger (logging): logger object to log the statements
+
+    Returns:
+        pivoted (pandas dataframe): StudyID x VariableName response frame
+        dfPII (pandas dataframe): PII flags for the section's variables
+    '''
+    # optional on-disk cache for development iterations: rereading the
+    # pivot from Parquet skips the SQL round-trips and the reshape
+    lo, hi = question_range
+    use_cache = os.environ.get('ETL_USE_PIVOT_CACHE') == '1'
+    if use_cache:
+        cache_key = hashlib.blake2b(f'{q_sect}:{lo}-{hi}'.encode(), digest_size=8).hexdigest()
+        pivot_file = os.path.join(cf.mock_data_df_path, f'{q_sect}_{cache_key}_pivot.parquet')
+        pii_file = os.path.join(cf.mock_data_df_path, f'{q_sect}_{cache_key}_pii.parquet')
+        if os.path.exists(pivot_file) and os.path.exists(pii_file):
+            _log.debug('Loaded cached pivot for %s', q_sect)
+            return pd.read_parquet(pivot_file), pd.read_parquet(pii_file)
+
+    conn = _get_connection(logger)
+
+    # the responses query returns millions of rows; stream it in chunks
+    # so the long-form frame is built batch by batch rather than from
+    # one giant row list
+    query = (f'SELECT StudyID, VariableName, ResponseText FROM GeneralResponses '
+             f'WHERE RoundID = 1 AND QuestionID BETWEEN {lo} AND {hi}')
+    chunks = pd.read_sql(query, conn, chunksize=200_000)
+    df = pd.concat(chunks, ignore_index=True)
+
+    allQuest, allFlag = _question_metadata(logger)
+    dfQuest = allQuest.loc[allQuest['QuestionID'].between(lo, hi)]
+    dfPII = allFlag.loc[allFlag['QuestionID'].between(lo, hi), ['VariableName', 'PII']]
+
+    merged = df.merge(dfQuest[['VariableName', 'Section', 'QuestionTypeID']], on='VariableName')
+    # categorical codes make the reshape an integer groupby instead of
+    # hashing the same name/id strings once per row
+    merged['VariableName'] = merged['VariableName'].astype('category')
+    merged['StudyID'] = merged['StudyID'].astype('category')
+    pivoted = (merged.set_index(['StudyID', 'VariableName'])['ResponseText']
+               .unstack('VariableName', fill_value=''))
+
+    if use_cache:
+        try:
+            os.makedirs(cf.mock_data_df_path, exist_ok=True)
+            pivoted.to_parquet(pivot_file)
+            dfPII.to_parquet(pii_file)
+        except OSError as e:
+            logger.warning(f'Could not write pivot cache for {q_sect}: {e}')
+
+    _log.debug('Loaded and pivoted %d responses for %s', len(df), q_sect)
+    return pivoted, dfPII
+
+
+def mask_pii(data, pii_mask, nested_array_keys=None):
+    '''
+    Removes the PII-flagged variables from every participant record,
+    including inside the nested arrays
+
+    Parameters:
+        data (dict): StudyID -> nested record
+        pii_mask: VariableName/PII flags dataframe, or a precomputed
+            (frozen)set of PII variable names
+        nested_array_keys (tuple): the record's array fields to mask
+            inside, normally SchemaIndex.nested_array_keys
+
+    Returns:
+        data (dict): the same object with PII fields removed
+    '''
+    if isinstance(pii_mask, (set, frozenset)):
+        pii_vars = pii_mask
+    else:
+        pii_vars = frozenset(pii_mask.loc[pii_mask['PII'] == 1, 'VariableName'])
+    if nested_array_keys is None:
+        nested_array_keys = ('RecordedHeights', 'Institutions', 'Pregnancies')
+
+    for record in data.values():
+        # dict-view intersection: O(dropped keys), no full-record key
+        # list copied per participant
+        for key in pii_vars & record.keys():
+            del record[key]
+        for array_name in nested_array_keys:
+            items = record.get(array_name)
+            if not items:
+                continue
+            for item in items:
+                for key in pii_vars & item.keys():
+                    del item[key]
+
+    _log.debug('Masked PII for %d participants', len(data))
+    return data
+
+
+def _dump_record(record):
+    if orjson is not None:
+        try:
+            return orjson.dumps(record)
+        except TypeError:
+            # orjson only takes plain dicts/str keys; fall through for
+            # shapes like the change-tracking defaultdicts
+            pass
+    return json.dumps(record, default=str).encode('utf-8')
+
+
+def save_output(data, out_path, filename):
+    '''
+    Writes one output JSON file for a section, streaming one record at a
+    time so the serialised text is never held in memory alongside the
+    data
+
+    Parameters:
+        data (dict or iterable): StudyID -> record mapping, or an
+            iterable of (study_id, record) pairs (e.g. a generator from
+            the restructuring step)
+        out_path (string): output directory
+        filename (string): output file name
+    '''
+    os.makedirs(out_path, exist_ok=True)
+    file_path = os.path.join(out_path, filename)
+
+    items = data.items() if isinstance(data, dict) else data
+    count = 0
+    with open(file_path, 'wb') as f:
+        f.write(b'{')
+        for study_id, record in items:
+            if count:
+                f.write(b',')
+            f.write(_dump_record(str(study_id)))
+            f.write(b':')
+            f.write(_dump_record(record))
+            count += 1
+        f.write(b'}')
+
+    _log.debug('Saved %d records to %s', count, file_path)
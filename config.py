@@ -82,7 +82,12 @@ stage_rules = {
                 'N3': ['3B','3B','3B','3B','3B','3C','3C','4A','4A','4B']
             }
 
-dateList = [[51, 52, 53], [135, 136, 137], [143, 144, 145], [151, 152, 153], [475, 476], [477, 478], [485, 486], [487, 488], [495, 496], [497, 498], [514, 515], [516, 517], [518, 519], 
+# The two big tables below are only needed by the date-derivation and
+# renaming scripts, so they are built lazily on first attribute access
+# (see __getattr__ at the bottom) instead of taxing every import of
+# config that just wants a path constant.
+def _build_dateList():
+    return [[51, 52, 53], [135, 136, 137], [143, 144, 145], [151, 152, 153], [475, 476], [477, 478], [485, 486], [487, 488], [495, 496], [497, 498], [514, 515], [516, 517], [518, 519], 
 [536, 537], [538, 539], [540, 541], [562, 563, 564], [575, 576, 577], [588, 589, 590], [601, 602, 603], [614, 615, 616], [627, 628, 629], [640, 641, 642], [653, 654, 655], [666, 667, 668], 
 [679, 680, 681], [692, 693, 694], [705, 706, 707], [718, 719, 720], [858, 859], [860, 861], [867, 868], [869, 870], [876, 877], [878, 879], [885, 886], [887, 888], [894, 895], [896, 897], 
 [903, 904], [905, 906], [912, 913], [914, 915], [920, 921], [922, 923], [928, 929], [930, 931], [937, 938], [939, 940], [945, 946], [947, 948], [953, 954], [955, 956], [961, 962], [963, 964], 
@@ -99,7 +104,8 @@ dateList = [[51, 52, 53], [135, 136, 137], [143, 144, 145], [151, 152, 153], [47
 [2612], [2617, 2618, 2619], [2623], [2627, 2628, 2629], [2633], [2637, 2638, 2639], [2643], [2647, 2648, 2649], [2653], [2657, 2658, 2659], [2663], [2667, 2668, 2669], [2673], [2677, 2678, 2679], 
 [2683], [2687, 2688, 2689], [2693], [2697, 2698, 2699], [2702], [2706, 2707, 2708], [2711], [2714, 2715, 2716], [2719], [3001, 3002, 3003]]
 
-newQuestionDict = {
+def _build_newQuestionDict():
+    raw = {
     51: "DOB",
     135: "RecordedHeight_1",
     143: "RecordedHeight_2",
@@ -329,7 +335,34 @@ newQuestionDict = {
     2714: "ChildCancerDOB_3",
     2719: "ChildCancerYear_3",
     3001: "QuestionnaireCompletionDate"
-}
+    }
+    return _MappingProxy({qid: _sys.intern(name) for qid, name in raw.items()})
+
+# The variable-name keyed mappings above are probed once per cell in the
+# processing loops: interning their string keys means every downstream
+# lookup reuses the cached hash of the interned key, and the proxy wrap
+# stops scripts mutating shared config by accident. newQuestionDict's
+# values are variable names that become dict keys later, so those are
+# interned too.
+import sys as _sys
+from types import MappingProxyType as _MappingProxy
+
+
+def _intern_keys(mapping):
+    return _MappingProxy({_sys.intern(k): v for k, v in mapping.items()})
+
+
+casum_convert_fields = _intern_keys(casum_convert_fields)
+casum_canreg_dtype_updates = _intern_keys(casum_canreg_dtype_updates)
+casum_data_sources = _intern_keys(casum_data_sources)
+brca_variables_to_map = _intern_keys(brca_variables_to_map)
+brca_special_rules = _intern_keys(brca_special_rules)
+ovca_variables_to_map = _intern_keys(ovca_variables_to_map)
+ovca_special_rules = _intern_keys(ovca_special_rules)
+legacy_variables_to_map = _intern_keys(legacy_variables_to_map)
+legacy_special_rules = _intern_keys(legacy_special_rules)
+stage_rules = _intern_keys(stage_rules)
+
 
 # IN RDS
 data_loc = 'R:\\_JSON_Data'
@@ -378,4 +411,41 @@ mock_data_json_path = schema_derivation + r'\mock_data\\json'
 
 validation_path = schema_derivation + r'\validation'
 
-ct_path = validation_path + r'\_change_tracking'
\ No newline at end of file
+ct_path = validation_path + r'\_change_tracking'
+
+
+def _date_list_cached():
+    # go through the module attribute so the lazy __getattr__ path
+    # builds and caches dateList at most once, however many of the
+    # derived tables are touched
+    return _sys.modules[__name__].dateList
+
+
+def _build_date_qids():
+    # flat O(1) membership over every date-group question id
+    return frozenset(q for group in _date_list_cached() for q in group)
+
+
+def _build_date_group_of():
+    # question id -> index of its group in dateList, for callers that
+    # need the siblings of a date component without a linear scan
+    return {q: i for i, group in enumerate(_date_list_cached()) for q in group}
+
+
+_LAZY_BUILDERS = {
+    'dateList': _build_dateList,
+    'newQuestionDict': _build_newQuestionDict,
+    'DATE_QIDS': _build_date_qids,
+    'DATE_GROUP_OF': _build_date_group_of,
+}
+
+
+def __getattr__(name):
+    # PEP 562: the big tables are built on first access and cached in
+    # the module namespace, so later accesses hit the attribute directly
+    builder = _LAZY_BUILDERS.get(name)
+    if builder is None:
+        raise AttributeError(f"module 'config' has no attribute {name!r}")
+    value = builder()
+    globals()[name] = value
+    return value
\ No newline at end of file
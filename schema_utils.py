@@ -0,0 +1,259 @@
+# schema_utils.py
+#
+# Helpers for pulling cleaning metadata out of the section JSON schemas:
+# per-field min/max constraints, expected JSON types and the raw
+# variable -> schema field mapping.
+
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from sys import intern
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_log = logging.getLogger(__name__)
+
+
+def load_schema(path: str) -> dict:
+    '''
+    Parses one schema file, using orjson when available — it parses the
+    wide section schemas several times faster than the stdlib
+
+    Parameters:
+        path (string): path to the schema JSON file
+
+    Returns:
+        schema (dict): the parsed schema
+    '''
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# parsed schemas are static for the lifetime of a run, so repeated
+# extraction over the same schema object returns the memoized tables.
+# Each entry stores the schema alongside its result: the strong
+# reference pins the dict so a dropped schema's id() cannot be recycled
+# onto a different one and alias its tables
+_meta_cache = {}
+
+
+@dataclass(slots=True, frozen=True)
+class Constraint:
+    '''Numeric range for one field; None means the bound is open'''
+    min: object
+    max: object
+
+
+# bounds repeat heavily across fields (e.g. 1-5 scales), so identical
+# (min, max) pairs share one frozen instance
+_constraint = lru_cache(maxsize=None)(Constraint)
+
+
+def _pick_minmax(schemas: list) -> tuple:
+    '''The range from the first subschema that carries a bound'''
+    s = next((x for x in schemas if 'minimum' in x or 'maximum' in x), None)
+    if s is None:
+        return None, None
+    return s.get('minimum'), s.get('maximum')
+
+
+def _extract_one(field: str, props: dict[str, Any],
+                 constraint_map: dict[str, Constraint],
+                 var_type_map: dict[str, str]) -> None:
+    '''Pulls the range and type for one field entry into the two maps'''
+    # JSON parsing does not intern: interning the keys and the handful
+    # of repeated type names shares one object per distinct string, so
+    # downstream lookups and comparisons hit identity fast paths
+    field = intern(field)
+    if 'anyOf' in props:
+        min_val, max_val = _pick_minmax(props['anyOf'])
+        if min_val is None and max_val is None:
+            min_val = props.get('minimum')
+            max_val = props.get('maximum')
+    else:
+        min_val = props.get('minimum')
+        max_val = props.get('maximum')
+    constraint_map[field] = _constraint(min_val, max_val)
+
+    field_type = props.get('type')
+    if isinstance(field_type, list):
+        var_type_map[field] = intern(field_type[0])
+    elif field_type is not None:
+        var_type_map[field] = intern(field_type)
+    elif 'anyOf' in props:
+        for subschema in props['anyOf']:
+            if 'type' in subschema and subschema['type'] != 'null':
+                var_type_map[field] = intern(subschema['type'])
+                break
+
+
+def extract_field_metadata(schema_props: dict[str, dict[str, Any]]) -> tuple:
+    '''
+    Extracts the numeric range and expected JSON type for every field in
+    one traversal of the schema properties, descending into array items
+    at any depth
+
+    Parameters:
+        schema_props (dict): the properties dict of a section schema
+
+    Returns:
+        constraint_map (dict): field name -> Constraint
+        var_type_map (dict): field name -> JSON type name
+    '''
+    cached = _meta_cache.get(id(schema_props))
+    if cached is not None and cached[0] is schema_props:
+        return cached[1]
+
+    constraint_map = {}
+    var_type_map = {}
+    # breadth-first over the properties: one body handles every nesting
+    # level, where the old hand-inlined recursion stopped at depth one
+    frontier = deque(schema_props.items())
+    while frontier:
+        field, props = frontier.popleft()
+        _extract_one(field, props, constraint_map, var_type_map)
+        nested = props.get('items', {}).get('properties')
+        if nested:
+            frontier.extend(nested.items())
+
+    _log.debug('Extracted metadata for %d fields', len(constraint_map))
+    result = (constraint_map, var_type_map)
+    _meta_cache[id(schema_props)] = (schema_props, result)
+    return result
+
+
+def extract_constraints(schema_props: dict[str, dict[str, Any]]) -> dict[str, Constraint]:
+    '''
+    Extracts the numeric range for every field in the schema properties,
+    including fields nested one level down in array items
+
+    Parameters:
+        schema_props (dict): the properties dict of a section schema
+
+    Returns:
+        constraint_map (dict): field name -> Constraint
+    '''
+    return extract_field_metadata(schema_props)[0]
+
+
+def extract_var_types(schema_props: dict[str, dict[str, Any]]) -> dict[str, str]:
+    '''
+    Extracts the expected JSON type for every field in the schema
+    properties, including fields nested one level down in array items
+
+    Parameters:
+        schema_props (dict): the properties dict of a section schema
+
+    Returns:
+        var_type_map (dict): field name -> JSON type name
+    '''
+    return extract_field_metadata(schema_props)[1]
+
+
+# compact codes so the per-field type can live in an int8 array
+_TYPE_CODES = {'string': 0, 'integer': 1, 'number': 2, 'boolean': 3,
+               'array': 4, 'object': 5}
+
+
+@dataclass(slots=True, frozen=True)
+class SchemaTable:
+    '''
+    Structure-of-arrays layout of the per-field schema metadata: bounds
+    and type codes live in parallel numpy arrays indexed through
+    field_index, so callers can range-check whole columns with one
+    vectorised expression instead of two dict hops per row
+    '''
+    field_index: dict
+    min_arr: np.ndarray
+    max_arr: np.ndarray
+    type_arr: np.ndarray
+
+
+# (schema, table) entries, pinning the schema like _meta_cache does
+_table_cache = {}
+
+
+def compile_schema(schema_props: dict[str, dict[str, Any]]) -> SchemaTable:
+    '''
+    Compiles the extracted field metadata into a SchemaTable
+
+    Open bounds become -inf/+inf so a column c validates directly as
+    (c >= min_arr[i]) & (c <= max_arr[i]).
+
+    Parameters:
+        schema_props (dict): the properties dict of a section schema
+
+    Returns:
+        table (SchemaTable): flat arrays plus the field -> index map
+    '''
+    cached = _table_cache.get(id(schema_props))
+    if cached is not None and cached[0] is schema_props:
+        return cached[1]
+
+    constraint_map, var_type_map = extract_field_metadata(schema_props)
+    fields = list(constraint_map)
+    n = len(fields)
+    min_arr = np.full(n, -np.inf)
+    max_arr = np.full(n, np.inf)
+    type_arr = np.zeros(n, dtype=np.int8)
+    for i, field in enumerate(fields):
+        constraint = constraint_map[field]
+        if constraint.min is not None:
+            min_arr[i] = constraint.min
+        if constraint.max is not None:
+            max_arr[i] = constraint.max
+        type_arr[i] = _TYPE_CODES.get(var_type_map.get(field, 'string'), 0)
+
+    table = SchemaTable({field: i for i, field in enumerate(fields)},
+                        min_arr, max_arr, type_arr)
+    _table_cache[id(schema_props)] = (schema_props, table)
+    return table
+
+
+def validate_numeric(values, table):
+    '''
+    Out-of-range mask for a block of numeric values against the compiled
+    bounds — one broadcast numpy expression over the whole block, no
+    per-row Python
+
+    Parameters:
+        values (numpy array): rows x fields block, columns ordered by
+            table.field_index; NaN marks missing values
+        table (SchemaTable): compiled bounds from compile_schema
+
+    Returns:
+        mask (numpy array): True where a value falls outside its range
+    '''
+    with np.errstate(invalid='ignore'):
+        return (values < table.min_arr) | (values > table.max_arr)
+
+
+def build_variable_mapping(schema: dict[str, Any]) -> dict[str, str]:
+    '''
+    Builds the raw variable name -> schema field name mapping from the
+    'name' annotations in the schema
+
+    Parameters:
+        schema (dict): parsed section schema (additionalProperties form)
+
+    Returns:
+        variable_mapping (dict): raw variable name -> schema field name
+    '''
+    # prop.get with a walrus fetches the name once, versus the
+    # contains-then-index pair of probes
+    return {
+        name: key
+        for key, prop in schema['additionalProperties']['properties'].items()
+        if (name := prop.get('name')) is not None
+    }
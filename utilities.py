@@ -1,40 +1,72 @@
 import config as cf
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
 import urllib
 import sys
 import pyodbc
+import atexit
 from datetime import datetime
+from functools import lru_cache
 import os
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
+
+
+# one engine per (database, server): each engine owns a connection
+# pool, so constructing a fresh one per call defeated pooling and
+# leaked pyodbc handles
+_engine_cache = {}
+
+# constant connection-string shape, composed once at import
+_ODBC_TEMPLATE = ';'.join(('DRIVER={}', 'SERVER={}', 'DATABASE={}',
+                           'Trusted_connection=yes'))
+
+
+@lru_cache(maxsize=16)
+def _build_url(db_name, server, driver):
+    '''The quoted pyodbc connection URL, memoised per target'''
+    params = urllib.parse.quote_plus(_ODBC_TEMPLATE.format(driver, server, db_name))
+    return 'mssql+pyodbc:///?odbc_connect=' + params
 
 
 def connect_DB(db_name, server, logger):
     '''
     Returns the connection object to the database
-    
+
     Parameters:
         db_name (string): database name to be connected
         server (string): database server to connect
         logger (logging): logger object to log the statements
-        
+
     Returns:
         engine (object): connection object to the specified database
     '''
+    key = (db_name, server)
+    engine = _engine_cache.get(key)
+    if engine is not None:
+        return engine
+
     try:
         # connection string for SQL Server database
-        params = urllib.parse.quote_plus(f'DRIVER={cf.driver_64};SERVER={server};DATABASE={db_name};Trusted_connection=yes')
-        url = f'mssql+pyodbc:///?odbc_connect={params}'
-        engine = create_engine(url)
-        
+        url = _build_url(db_name, server, cf.driver_64)
+        engine = create_engine(url, pool_pre_ping=True, fast_executemany=True)
+
+        _engine_cache[key] = engine
         return engine
-    
+
     except Exception as e:
         logger.error('Failed to connect to the database' + str(e))
         sys.exit(1)
 
 
 
+# configured loggers per (name, path): createLogger used to re-attach a
+# fresh pair of handlers on every call, multiplying each log line
+_LOGGERS = {}
+
+
 def createLogger(name, path):
     '''
     Creates the logging object to store each log statement in specified format
@@ -43,54 +75,137 @@ def createLogger(name, path):
         path (string): path for saving the log file
     Returns:
         logger (logging object): object used in the main script to log the statements
-    '''  
+    '''
+    cached = _LOGGERS.get((name, path))
+    if cached is not None:
+        return cached
+
     # set the logging object to required configuration
     timestamp = datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
     log_filename = name + '_Log_' + timestamp + '.log'
     log_location = os.path.join(path, log_filename)
-    
-    logger = logging.getLogger('QuestionnaireETL')
+
+    # one child logger per process name: a shared logger would hand a
+    # later section the handlers (and log file) of whichever section
+    # configured it first in this process
+    logger = logging.getLogger(f'QuestionnaireETL.{name}')
     logger.setLevel(logging.INFO)
-    
+    # no duplicate records via the parent or root logger
+    logger.propagate = False
+    if logger.handlers:
+        # already configured by an earlier call in this process
+        _LOGGERS[(name, path)] = logger
+        return logger
+
     # add location for log file to be saved
     file_handler = logging.FileHandler(log_location)
     file_handler.setLevel(logging.INFO)
-    
+
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(logging.INFO)
-    
+
     # format the log message
     formatter = logging.Formatter("%(asctime)s - %(levelname)s: %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(formatter)
     stream_handler.setFormatter(formatter)
-        
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
-    
+
+    # the real handlers live behind a queue on a background thread, so
+    # a log call in the processing loops is just a queue.put instead of
+    # synchronous disk and console writes
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, stream_handler,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+
+    _LOGGERS[(name, path)] = logger
     return logger
 
 
 
-def read_data(query, conn, logger):
+def read_data(query, conn, logger, chunksize=None):
     '''
     Returns a dataframe
-    
+
     Parameters:
         query (string): query to run to read data from SQL Server
         conn (object): connection object for the specific databse to be queried
         logger (logging): logger object to log the statements
+        chunksize (int): when given, read the result set in batches of
+            this many rows and concatenate, capping peak memory
     Returns:
         df (pandas dataframe): dataframe containing the results of the query
-    '''    
-    import traceback
+    '''
     try:
-        df = pd.read_sql(query, conn)
-        
+        if chunksize is not None:
+            df = pd.concat(pd.read_sql(query, conn, chunksize=chunksize),
+                           ignore_index=True, copy=False)
+        else:
+            df = pd.read_sql(query, conn)
+
         return df
-    
-    except Exception as e:
-        logger.error('Failed to execute the query' + str(e))
-        logger.error(traceback.format_exec())
+
+    except Exception:
+        logger.error('Failed to execute the query', exc_info=True)
+        sys.exit(1)
+
+
+def read_data_typed(query, conn, table, n_rows, logger, batch_size=50_000):
+    '''
+    Returns a typed dataframe filled from a raw pyodbc cursor
+
+    Columns known to the compiled schema table as integer/number land in
+    preallocated float64 arrays (NULL as NaN); everything else goes into
+    object arrays. Skips pandas' per-chunk type inference and the extra
+    copy read_sql makes.
+
+    Parameters:
+        query (string): query to run to read data from SQL Server
+        conn (object): connection object for the specific databse to be queried
+        table (SchemaTable): compiled field types from schema_utils
+        n_rows (int): row count to preallocate for (e.g. from COUNT(*))
+        logger (logging): logger object to log the statements
+        batch_size (int): rows fetched per cursor round-trip
+    Returns:
+        df (pandas dataframe): dataframe containing the results of the query
+    '''
+    try:
+        cursor = conn.raw_connection().cursor()
+        cursor.execute(query)
+        cols = [description[0] for description in cursor.description]
+
+        arrays = []
+        numeric = []
+        for col in cols:
+            idx = table.field_index.get(col)
+            code = int(table.type_arr[idx]) if idx is not None else 0
+            if code in (1, 2):
+                arrays.append(np.full(n_rows, np.nan))
+                numeric.append(True)
+            else:
+                arrays.append(np.empty(n_rows, dtype=object))
+                numeric.append(False)
+
+        offset = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            n = len(rows)
+            for j, arr in enumerate(arrays):
+                values = [row[j] for row in rows]
+                if numeric[j]:
+                    values = [np.nan if v is None else v for v in values]
+                arr[offset:offset + n] = values
+            offset += n
+        cursor.close()
+
+        return pd.DataFrame({col: arr[:offset] for col, arr in zip(cols, arrays)},
+                            copy=False)
+
+    except Exception:
+        logger.error('Failed to execute the query', exc_info=True)
         sys.exit(1)
 
 